@@ -5,6 +5,7 @@ import re
 import numpy as np
 
 from extract import read_dialog_data
+from profiler import stage
 
 
 def get_most_frequent(y):
@@ -17,79 +18,177 @@ def assign_most_frequent(y):
     return [get_most_frequent(y)] * len(y)
 
 
-def assign_rule_based(x, most_frequent="inform"):
+# Rules that map a pattern to a dialog act, earlier rules take priority
+PATTERN_MAPPING = [
+    (r"^.*thank.*$", "thankyou"),
+    (r"^.*(what|address|phone|number|post? code|zip? code).*$", "request"),
+    (r"^.*(what|how) about.*$", "reqalts"),
+    (r"^.*(yes|correct).*$", "affirm"),
+    (r"^.*(cheap|price|expensive).*$", "inform"),
+    (r"^.*(\wnot\w|\wno\w).*$", "negate"),
+    (r"^.*(good? bye)|(\wbye\w).*$", "bye"),
+    (r"^.*(unintellgible|noisy|cough|tv_noise).*$", "null"),
+    (r"^.*(hello).*$", "hello"),
+]
+
+
+def split_alternatives(pattern):
+    """Split a regex on the | characters that are not nested in a group or set."""
+    alternatives, start, depth, in_set, escaped = [], 0, 0, False, False
+    for idx, char in enumerate(pattern):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif in_set:
+            in_set = char != "]"
+        elif char == "[":
+            in_set = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            alternatives.append(pattern[start:idx])
+            start = idx + 1
+    alternatives.append(pattern[start:])
+    return alternatives
+
+
+def line_regexes(pattern):
+    """
+    Turn a pattern for re.match into regexes that search a newline joined buffer.
+
+    An alternative of the form ^.*body.*$ matches a line as soon as the body occurs
+    somewhere in it, so it is searched for without anchors, which the regex engine
+    does a lot faster. Other alternatives are anchored to the start of each line.
+    """
+    regexes = []
+    for alternative in split_alternatives(pattern):
+        if alternative.endswith(".*$"):
+            alternative = alternative[:-3]
+        if alternative.startswith("^.*"):
+            regexes.append(re.compile(alternative[3:]))
+        else:
+            regexes.append(re.compile(f"^(?:{alternative})", re.MULTILINE))
+    return regexes
+
+
+class RuleBasedClassifier:
+    """
+    Rule based dialog act classifier, compiled once from a rule table.
+
+    All rules are combined into a single regex, with one named alternative per rule.
+    The regex engine tries the alternatives in the order of the rule table, so each
+    sentence is matched with one call, and the first rule that matches wins.
+    """
+
+    def __init__(self, pattern_mapping, default="inform"):
+        self.default = default
+        self.labels = {
+            f"rule{idx}": label for idx, (_, label) in enumerate(pattern_mapping)
+        }
+        self.label_array = np.array([label for _, label in pattern_mapping])
+        self.line_regexes = [line_regexes(patt) for patt, _ in pattern_mapping]
+        self.regex = re.compile(
+            "|".join(
+                f"(?P<rule{idx}>{patt})"
+                for idx, (patt, _) in enumerate(pattern_mapping)
+            )
+        )
+
+    def classify(self, sentence, default=None):
+        """Assign a dialog act to a sentence, or default if no rule matches."""
+        match = self.regex.match(sentence)
+        if match:
+            return self.labels[match.lastgroup]
+        return self.default if default is None else default
+
+    def classify_batch(self, sentences, default=None):
+        """Assign a dialog act to each sentence in an iterable of sentences."""
+        default = self.default if default is None else default
+        match, labels = self.regex.match, self.labels
+        predicted_labels = []
+        for sentence in sentences:
+            result = match(sentence)
+            predicted_labels.append(labels[result.lastgroup] if result else default)
+        return predicted_labels
+
+    def classify_array(self, sentences, default=None):
+        """
+        Assign a dialog act to a whole array of sentences at once.
+
+        Sentences are joined into one buffer, that each rule scans once. Match
+        positions are mapped back to rows, which gives a boolean mask per rule, and
+        the priority between rules is resolved with np.select.
+        """
+        default = self.default if default is None else default
+        sentences = np.asarray(sentences, dtype=object)
+        if len(sentences) == 0:
+            return np.array([], dtype=self.label_array.dtype)
+        buffer = "\n".join(sentences)
+        if buffer.count("\n") != len(sentences) - 1:
+            raise ValueError("Sentences can not contain newlines")
+
+        # Offset of the first character of each sentence in the buffer
+        lengths = np.fromiter(map(len, sentences), dtype=np.int64, count=len(sentences))
+        starts = np.cumsum(lengths + 1) - lengths - 1
+
+        masks = []
+        for regexes in self.line_regexes:
+            mask = np.zeros(len(sentences), dtype=bool)
+            for regex in regexes:
+                positions = np.fromiter(
+                    (match.start() for match in regex.finditer(buffer)), dtype=np.int64
+                )
+                mask[np.searchsorted(starts, positions, side="right") - 1] = True
+            masks.append(mask)
+        return np.select(masks, self.label_array, default=default)
+
+
+# Classifier that is compiled once, and shared by all callers
+RULE_BASED_CLASSIFIER = RuleBasedClassifier(PATTERN_MAPPING)
+
+
+def assign_rule_based(x, most_frequent="inform", columnar=False):
     """
     Assign a dialog act to each sentence in x based on matching patterns.
 
-    If no pattern matches, predict most frequent.
+    If no pattern matches, predict most frequent. In columnar mode, the whole array of
+    sentences is classified at once, and a NumPy array is returned.
     """
-    pattern_mapping = [
-        (r"^.*thank.*$", "thankyou"),
-        (r"^.*(what|address|phone|number|post? code|zip? code).*$", "request"),
-        (r"^.*(what|how) about.*$", "reqalts"),
-        (r"^.*(yes|correct).*$", "affirm"),
-        (r"^.*(cheap|price|expensive).*$", "inform"),
-        (r"^.*(\wnot\w|\wno\w).*$", "negate"),
-        (r"^.*(good? bye)|(\wbye\w).*$", "bye"),
-        (r"^.*(unintellgible|noisy|cough|tv_noise).*$", "null"),
-        (r"^.*(hello).*$", "hello"),
-    ]
-    # Initialise an empty list to save predictions in
-    predicted_labels = []
-
-    # Loop over each sentence in the data
-    for sentence in x:
-
-        # Initialise variables for the loop
-        i = 0
-        assigned = False
-
-        # While there are patterns left to try, and nothing has yet been assigned
-        while not assigned and i < len(pattern_mapping):
-
-            # Get the predicate and label that belongs to it from the pattern mapping
-            patt, label = pattern_mapping[i]
-
-            # If our pattern matches
-            if re.match(patt, sentence):
-
-                # Set assigned, so we won't loop again
-                assigned = True
-
-                # Add label to the predictions
-                predicted_labels.append(label)
-            i += 1
-        # If after looping we didn't assign any label, just assign the most frequent
-        if not assigned:
-            predicted_labels.append(most_frequent)
-    return predicted_labels  # Finally, return all our predictions
+    if columnar:
+        return RULE_BASED_CLASSIFIER.classify_array(x, default=most_frequent)
+    return RULE_BASED_CLASSIFIER.classify_batch(x, default=most_frequent)
 
 
 def evaluate(labels, predictions):
     """Returns what percentage of predictions matches the given labels."""
 
     # Make numpy arrays to get boolean array, for each element True if they match.
-    matches = np.array(labels) == np.array(predictions)
+    # Arrays are used as is, so columnar predictions are never copied.
+    matches = np.asarray(labels) == np.asarray(predictions)
 
-    # Get the total number of matches, and calculate percentage
-    n_correct = np.sum(matches)
-    percentage_correct = n_correct / len(matches) * 100
-    return percentage_correct
+    # The mean of the matches is the fraction that is correct
+    return np.mean(matches) * 100
 
 
 if __name__ == "__main__":
     print("Loading raw data...")
-    xs, ys = read_dialog_data()
+    with stage("load data"):
+        xs, ys = read_dialog_data()
     most_frequent = get_most_frequent(ys)
 
     print("Baseline 1: Assigning most frequent..")
-    most_frequent_ys = assign_most_frequent(ys)
+    with stage("most frequent"):
+        most_frequent_ys = assign_most_frequent(ys)
     print()
     print(f"Most frequent {most_frequent}")
     print(f"Correct: {evaluate(ys, most_frequent):.2f}%")
     print()
 
     print("Baseline 2: Assigning labels based on rules...")
-    y_pred = assign_rule_based(xs, most_frequent=most_frequent)
+    with stage("rule based"):
+        y_pred = assign_rule_based(xs, most_frequent=most_frequent, columnar=True)
     print()
     print(f"Correct {evaluate(ys, y_pred):.2f}%")
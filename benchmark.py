@@ -0,0 +1,829 @@
+"""
+Benchmarks that compare the performance of implementations in this package.
+
+Run this file to run all benchmarks, or pass the names of the benchmarks to run.
+Inputs are seeded, so runs measure the same work. Results can be saved as JSON with
+--output, and compared with the results of an earlier run with --compare, which
+flags the metrics that regressed by more than a threshold.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import timeit
+
+from extract import read_dialog_data
+
+# All registered benchmarks, by name
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark under the name of its function."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def time_call(func, *args, repeat=5, number=1):
+    """Best wall-clock time in seconds of calling func with args."""
+    timings = timeit.repeat(lambda: func(*args), repeat=repeat, number=number)
+    return min(timings) / number
+
+
+def sequential_rule_based(x, pattern_mapping, most_frequent="inform"):
+    """Reference implementation that tries each rule with a separate re.match."""
+    predicted_labels = []
+    for sentence in x:
+        for patt, label in pattern_mapping:
+            if re.match(patt, sentence):
+                predicted_labels.append(label)
+                break
+        else:
+            predicted_labels.append(most_frequent)
+    return predicted_labels
+
+
+@benchmark
+def rule_based():
+    """Compare the compiled rule based classifier with sequential matching."""
+    from baseline import PATTERN_MAPPING, RuleBasedClassifier
+
+    sentences, _ = read_dialog_data()
+    classifier = RuleBasedClassifier(PATTERN_MAPPING)
+
+    expected = sequential_rule_based(sentences, PATTERN_MAPPING)
+    if classifier.classify_batch(sentences) != expected:
+        raise AssertionError("Compiled classifier assigns different labels")
+
+    sequential = time_call(sequential_rule_based, sentences, PATTERN_MAPPING)
+    compiled = time_call(classifier.classify_batch, sentences)
+    return {
+        "n_sentences": len(sentences),
+        "sequential_s": sequential,
+        "compiled_s": compiled,
+        "speedup": sequential / compiled,
+    }
+
+
+@benchmark
+def rule_based_columnar():
+    """Compare the columnar rule based classifier with the per sentence one."""
+    import numpy as np
+
+    from baseline import PATTERN_MAPPING, RuleBasedClassifier, evaluate
+
+    sentences, labels = read_dialog_data()
+    # Repeat the corpus, to measure at a scale where the columnar mode matters
+    sentences, labels = np.array(sentences * 10), np.array(labels * 10)
+    classifier = RuleBasedClassifier(PATTERN_MAPPING)
+
+    expected = classifier.classify_batch(sentences)
+    if not np.array_equal(classifier.classify_array(sentences), expected):
+        raise AssertionError("Columnar classifier assigns different labels")
+
+    per_sentence = time_call(
+        lambda: evaluate(labels, classifier.classify_batch(sentences)), repeat=3
+    )
+    columnar = time_call(
+        lambda: evaluate(labels, classifier.classify_array(sentences)), repeat=3
+    )
+    return {
+        "n_sentences": len(sentences),
+        "per_sentence_s": per_sentence,
+        "columnar_s": columnar,
+        "speedup": per_sentence / columnar,
+    }
+
+
+def random_words(n_words, seed=0):
+    """Set of random lowercase words, of four to eleven letters."""
+    import numpy as np
+
+    random_state = np.random.RandomState(seed)
+    return {
+        "".join(random_state.choice(list("abcdefghijklmnopqrstuvwxyz"), size=size))
+        for size in random_state.randint(4, 12, size=n_words)
+    }
+
+
+def regex_keywords(sentence, keywords):
+    """Reference implementation that builds a regex of the keywords per call."""
+    result = re.search(rf"\b({'|'.join(keywords)})\b", sentence)
+    if result:
+        return result.group(1)
+
+
+@benchmark
+def keyword_matching():
+    """Compare the keyword automaton with a regex, for a small and a large vocabulary."""
+    import numpy as np
+
+    from keyword_automaton import KeywordAutomaton
+    from templates import KNOWN_FOODS
+
+    sentences, _ = read_dialog_data()
+    # Random words as a vocabulary of thousands of foods, that still match sentences
+    large_vocabulary = KNOWN_FOODS | random_words(5000)
+
+    results = {"n_sentences": len(sentences)}
+    for name, vocabulary in [("small", KNOWN_FOODS), ("large", large_vocabulary)]:
+        automaton = KeywordAutomaton(vocabulary)
+        # Order the alternatives longest first, so the regex also matches the longest
+        ordered = sorted(vocabulary, key=lambda keyword: (-len(keyword), keyword))
+        expected = [regex_keywords(sentence, ordered) for sentence in sentences]
+        if [automaton.find(sentence) for sentence in sentences] != expected:
+            raise AssertionError("Automaton matches different keywords")
+
+        results[f"{name}_n_keywords"] = len(vocabulary)
+        results[f"{name}_build_s"] = time_call(KeywordAutomaton, vocabulary)
+        results[f"{name}_regex_s"] = time_call(
+            lambda: [regex_keywords(sentence, ordered) for sentence in sentences]
+        )
+        results[f"{name}_automaton_s"] = time_call(
+            lambda: [automaton.find(sentence) for sentence in sentences]
+        )
+    return results
+
+
+def linear_close_words(word, known_words, minimum_dist=3):
+    """Reference implementation that computes the distance to every known word."""
+    from Levenshtein import distance
+
+    return [
+        known_word
+        for known_word in known_words
+        if distance(word, known_word) <= minimum_dist
+    ]
+
+
+@benchmark
+def fuzzy_matching():
+    """Compare the fuzzy index with computing the distance to every known word."""
+    import numpy as np
+
+    from fuzzy_index import FuzzyIndex
+    from templates import KNOWN_FOODS
+
+    vocabulary = sorted(KNOWN_FOODS | random_words(5000))
+    # Misspell known words by replacing one of their letters
+    random_state = np.random.RandomState(1)
+    typos = []
+    for word in random_state.choice(vocabulary, size=500):
+        position = random_state.randint(len(word))
+        typos.append(word[:position] + "x" + word[position + 1 :])
+
+    index = FuzzyIndex(vocabulary)
+    for typo in typos:
+        expected = sorted(linear_close_words(typo, vocabulary))
+        if sorted(word for _, word in index.search(typo, 3)) != expected:
+            raise AssertionError("Fuzzy index finds different words")
+
+    def uncached_search():
+        """Search every typo, with the cache of earlier runs cleared."""
+        index.search.cache_clear()
+        return [index.search(typo, 3) for typo in typos]
+
+    return {
+        "n_keywords": len(vocabulary),
+        "n_typos": len(typos),
+        "build_s": time_call(FuzzyIndex, vocabulary, repeat=3),
+        "linear_s": time_call(
+            lambda: [linear_close_words(typo, vocabulary) for typo in typos]
+        ),
+        "index_s": time_call(uncached_search),
+        "index_cached_s": time_call(lambda: [index.search(typo, 3) for typo in typos]),
+    }
+
+
+def peak_memory(func, *args):
+    """Peak memory in bytes that Python allocates while calling func with args."""
+    import tracemalloc
+
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+@benchmark
+def vectorizers():
+    """Compare the own sparse vectorizer with the vectorizers of sklearn."""
+    from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+
+    from vectorize import BagOfWordsVectorizer
+
+    sentences, _ = read_dialog_data()
+    # Repeat the corpus, to measure throughput on a larger amount of sentences
+    sentences = sentences * 10
+    n_features = 2**18
+
+    own = BagOfWordsVectorizer()
+    # Split on whitespace like the own vectorizer, so both count the same words
+    sklearn = CountVectorizer(token_pattern=r"\S+")
+    own_matrix, sklearn_matrix = own.fit_transform(sentences), sklearn.fit_transform(
+        sentences
+    )
+    columns = [own.vocabulary_[term] for term in sklearn.get_feature_names_out()]
+    if (own_matrix[:, columns] != sklearn_matrix).nnz:
+        raise AssertionError("Own vectorizer counts different words")
+
+    vectorizers = {
+        "own": lambda: BagOfWordsVectorizer().fit_transform(sentences),
+        "own_hashing": lambda: BagOfWordsVectorizer(n_features).fit_transform(
+            sentences
+        ),
+        "sklearn_count": lambda: CountVectorizer(token_pattern=r"\S+").fit_transform(
+            sentences
+        ),
+        "sklearn_hashing": lambda: HashingVectorizer(
+            n_features=n_features, token_pattern=r"\S+", alternate_sign=False, norm=None
+        ).fit_transform(sentences),
+    }
+    results = {"n_sentences": len(sentences)}
+    for name, fit_transform in vectorizers.items():
+        elapsed = time_call(fit_transform, repeat=3)
+        results[f"{name}_s"] = elapsed
+        results[f"{name}_sentences_per_s"] = len(sentences) / elapsed
+        results[f"{name}_peak_memory_mb"] = peak_memory(fit_transform) / 2**20
+    return results
+
+
+def cold_start(code, repeat=3):
+    """Best wall-clock time in seconds of running some code in a fresh interpreter."""
+    command = [sys.executable, "-W", "ignore", "-c", code]
+    return time_call(subprocess.run, command, repeat=repeat)
+
+
+@benchmark
+def model_loading():
+    """Compare the cold start of a pickled pipeline and of a model artifact."""
+    import numpy as np
+
+    from machine_learning import MODEL_DIR, load_model
+
+    sentences, _ = read_dialog_data()
+    results = {}
+    for name in ["log_reg", "multi_nb"]:
+        pipeline = load_model(f"{name}.pickle")
+        artifact = load_model(f"{name}.model")
+        if not np.array_equal(pipeline.predict(sentences), artifact.predict(sentences)):
+            raise AssertionError(f"Artifact of {name} predicts different labels")
+
+        # Time a fresh process that loads the model and predicts one sentence
+        pickle_path = os.path.join(MODEL_DIR, f"{name}.pickle")
+        artifact_path = os.path.join(MODEL_DIR, f"{name}.model")
+        results[f"{name}_pickle_cold_start_s"] = cold_start(
+            "import pickle\n"
+            f"model = pickle.load(open({pickle_path!r}, 'rb'))\n"
+            "model.predict(['hello'])"
+        )
+        results[f"{name}_artifact_cold_start_s"] = cold_start(
+            "from model_artifact import load_artifact\n"
+            f"load_artifact({artifact_path!r}).predict(['hello'])"
+        )
+    return results
+
+
+@benchmark
+def linear_models():
+    """
+    Compare predicting with a pickled pipeline and with the linear model in it.
+
+    The linear model is extracted with LinearModel.from_pipeline, and must predict
+    the same labels as the pipeline.
+    """
+    import numpy as np
+
+    from machine_learning import load_model
+    from model_artifact import LinearModel
+
+    single = sample_sentences(200)
+    batch = sample_sentences(5000, seed=SEED + 1)
+    results = {"n_single": len(single), "batch_size": len(batch)}
+    for name in ["log_reg", "multi_nb"]:
+        pipeline = load_model(f"{name}.pickle")
+        linear = LinearModel.from_pipeline(pipeline)
+        if not np.array_equal(pipeline.predict(batch), linear.predict(batch)) or any(
+            linear.predict([sentence]) != pipeline.predict([sentence])
+            for sentence in single
+        ):
+            raise AssertionError(f"Linear model of {name} predicts different labels")
+
+        for kind, model in [("pipeline", pipeline), ("linear", linear)]:
+            results[f"{name}_{kind}_predict_single_s"] = time_call(
+                lambda: [model.predict([sentence]) for sentence in single], repeat=3
+            ) / len(single)
+            results[f"{name}_{kind}_predict_batch_s"] = time_call(
+                model.predict, batch, repeat=3
+            )
+    return results
+
+
+@benchmark
+def restaurant_query():
+    """Compare querying a large catalogue through the index with filtering it."""
+    import pandas as pd
+
+    from dialog_system import Information, get_restaurant_data, query
+    from restaurant_index import RestaurantIndex
+
+    # Repeat the restaurants, to get a catalogue of about a hundred thousand rows
+    data = pd.concat([get_restaurant_data()] * 1000, ignore_index=True)
+    index = RestaurantIndex(data)
+    information = Information("cheap", "centre", "chinese")
+    conditions = information.get_conditions()
+
+    def filtered():
+        """Query like query_information did, by filtering a copy per slot."""
+        result = data.copy()
+        for condition in conditions:
+            result = query(result, condition)
+        return result
+
+    def indexed():
+        return data.iloc[index.select(conditions)]
+
+    if not filtered().equals(indexed()):
+        raise AssertionError("Index gives different restaurants")
+    return {
+        "n_rows": len(data),
+        "build_index_s": time_call(RestaurantIndex, data, repeat=3),
+        "filter_s": time_call(filtered),
+        "index_s": time_call(indexed),
+        "index_row_ids_s": time_call(index.select, conditions),
+    }
+
+
+@benchmark
+def inference_rules():
+    """Compare applying compiled inference rules with filtering recommendations."""
+    import pandas as pd
+
+    from dialog_system import INFERENCE_MAP, InferenceEngine, get_restaurant_data
+    from restaurant_index import RestaurantIndex
+
+    data = pd.concat([get_restaurant_data()] * 1000, ignore_index=True)
+    inferences = INFERENCE_MAP["touristic"]
+
+    def filtered():
+        """Infer like Inferences.infer did, by filtering and dropping rows."""
+        new_rec = inferences.true_inference.infer_from_data(data)
+        to_remove = inferences.false_inference.infer_from_data(new_rec)
+        return new_rec.drop(index=to_remove.index)
+
+    def build():
+        return InferenceEngine(INFERENCE_MAP, RestaurantIndex(data)).compile()
+
+    engine = build()
+    if not filtered().equals(engine.apply("touristic", True, data)):
+        raise AssertionError("Inference engine gives different restaurants")
+    return {
+        "n_rows": len(data),
+        "compile_s": time_call(build, repeat=3),
+        "filter_s": time_call(filtered),
+        "engine_s": time_call(engine.apply, "touristic", True, data),
+    }
+
+
+# Time within which a fresh dialog system should respond to its first user input
+STARTUP_BUDGET = 1.0
+
+STARTUP_SCRIPT = """
+import builtins
+import time
+
+start = time.perf_counter()
+import dialog_system
+
+imported = time.perf_counter()
+replies = iter(["hello"])
+
+
+class FirstResponse(Exception):
+    pass
+
+
+def scripted_input(prompt=""):
+    # The first prompt after the scripted reply is the first response
+    for reply in replies:
+        return reply
+    raise FirstResponse
+
+
+builtins.input = scripted_input
+try:
+    dialog_system.transition(dialog_system.welcome)
+except FirstResponse:
+    print(imported - start, time.perf_counter() - start)
+"""
+
+
+@benchmark
+def startup():
+    """Time from importing the dialog system to its first response, in a new process."""
+    timings = []
+    for _ in range(5):
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", STARTUP_SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        timings.append([float(value) for value in output.split()[-2:]])
+    import_time, first_response = min(timings, key=lambda timing: timing[1])
+    return {
+        "import_s": import_time,
+        "first_response_s": first_response,
+        "budget_s": STARTUP_BUDGET,
+        "within_budget": first_response <= STARTUP_BUDGET,
+    }
+
+
+# Seed of the random inputs, so every run measures the same work
+SEED = 0
+
+
+def sample_sentences(n_sentences, seed=SEED):
+    """A fixed random sample of the sentences of the dialog data."""
+    import numpy as np
+
+    sentences, _ = read_dialog_data()
+    random_state = np.random.RandomState(seed)
+    return [sentences[idx] for idx in random_state.choice(len(sentences), n_sentences)]
+
+
+def never_confirm(word, correction):
+    """Confirmation callback that declines every correction, without a prompt."""
+    return False
+
+
+@benchmark
+def templates():
+    """Time the template matchers and the fuzzy matching of words, per sentence."""
+    from dialog_system import Information
+    from templates import (
+        FOOD_AUTOMATON,
+        is_close_to_any,
+        match_area,
+        match_consequent,
+        match_food,
+        match_pricerange,
+        match_request,
+    )
+
+    matchers = {
+        "match_pricerange": lambda s: match_pricerange(s, confirm=never_confirm),
+        "match_area": lambda s: match_area(s, confirm=never_confirm),
+        "match_food": lambda s: match_food(s, confirm=never_confirm),
+        "match_request": lambda s: match_request(s, Information(None, None, None)),
+        "match_consequent": match_consequent,
+    }
+    sentences = sample_sentences(2000)
+    words = [word for sentence in sentences for word in sentence.split()]
+
+    results = {"n_sentences": len(sentences), "n_words": len(words)}
+    for name, matcher in matchers.items():
+        elapsed = time_call(lambda: [matcher(sentence) for sentence in sentences])
+        results[f"{name}_s"] = elapsed / len(sentences)
+    elapsed = time_call(
+        lambda: [is_close_to_any(word, FOOD_AUTOMATON) for word in words]
+    )
+    results["is_close_to_any_s"] = elapsed / len(words)
+    return results
+
+
+@benchmark
+def assign_rule_based():
+    """Time the rule based baseline, per sentence and on the whole array."""
+    import numpy as np
+
+    import baseline
+
+    sentences = sample_sentences(20000)
+    array = np.array(sentences)
+    return {
+        "n_sentences": len(sentences),
+        "per_sentence_s": time_call(baseline.assign_rule_based, sentences),
+        "columnar_s": time_call(
+            lambda: baseline.assign_rule_based(array, columnar=True)
+        ),
+    }
+
+
+@benchmark
+def dialog_queries():
+    """Time querying the restaurants, and applying the inferences to the results."""
+    import numpy as np
+
+    from dialog_system import (
+        INFERENCE_MAP,
+        Information,
+        get_restaurant_data,
+        query_information,
+    )
+    from templates import KNOWN_AREAS, KNOWN_FOODS, KNOWN_RANGES
+
+    data = get_restaurant_data()
+    random_state = np.random.RandomState(SEED)
+    informations = [
+        Information(
+            random_state.choice(sorted(KNOWN_RANGES | {"any"})),
+            random_state.choice(sorted(KNOWN_AREAS | {"any"})),
+            random_state.choice(sorted(KNOWN_FOODS | {"any"})),
+        )
+        for _ in range(200)
+    ]
+    # Build the index and compile the rules before timing
+    recommendations = [query_information(data, info) for info in informations]
+    everything = query_information(data, Information("any", "any", "any"))
+
+    def infer_all():
+        for inferences in INFERENCE_MAP.values():
+            for truth_value in [True, False]:
+                inferences.infer(everything, truth_value)
+
+    return {
+        "n_queries": len(informations),
+        "n_recommendations": sum(len(result) for result in recommendations),
+        "query_information_s": time_call(
+            lambda: [query_information(data, info) for info in informations]
+        )
+        / len(informations),
+        "infer_s": time_call(infer_all) / (2 * len(INFERENCE_MAP)),
+    }
+
+
+@benchmark
+def models():
+    """Time loading each pickled model, and predicting single sentences and a batch."""
+    from machine_learning import MODEL_DIR, MODELS, load_model
+
+    single = sample_sentences(200)
+    batch = sample_sentences(5000, seed=SEED + 1)
+    results = {"n_single": len(single), "batch_size": len(batch)}
+    for _, filename, _ in MODELS:
+        if not os.path.exists(os.path.join(MODEL_DIR, filename)):
+            continue
+        name = filename.rsplit(".", 1)[0]
+        try:
+            model = load_model(filename)
+        except Exception as error:
+            # Pickles of another sklearn version may not load
+            results[f"{name}_error"] = str(error).splitlines()[0]
+            continue
+        results[f"{name}_load_s"] = time_call(load_model, filename, repeat=3)
+        results[f"{name}_predict_single_s"] = time_call(
+            lambda: [model.predict([sentence]) for sentence in single], repeat=3
+        ) / len(single)
+        results[f"{name}_predict_batch_s"] = time_call(model.predict, batch, repeat=3)
+    return results
+
+
+@benchmark
+def nearest_neighbors():
+    """
+    Compare the sparse nearest neighbors classifier with KNeighborsClassifier.
+
+    Recall is the share of the neighbors of KNeighborsClassifier that the sparse
+    classifier finds too. Both find the nearest distances, but they break ties
+    between rows at the same distance differently, so distance recall counts the
+    queries whose neighbors are at the same distances.
+    """
+    import numpy as np
+    from sklearn.neighbors import KNeighborsClassifier
+
+    from feature_cache import get_features
+    from sparse_neighbors import SparseNeighborsClassifier
+
+    features = get_features()
+    queries = features.x_test
+    classifiers = {
+        "brute": KNeighborsClassifier(),
+        "sparse": SparseNeighborsClassifier(),
+    }
+    results = {"n_train": features.x_train.shape[0], "n_queries": queries.shape[0]}
+    neighbors, predictions = {}, {}
+    for name, classifier in classifiers.items():
+        classifier.fit(features.x_train, features.y_train)
+        neighbors[name] = classifier.kneighbors(queries)
+        predictions[name] = classifier.predict(queries)
+        results[f"{name}_fit_s"] = time_call(
+            classifier.fit, features.x_train, features.y_train, repeat=3
+        )
+        results[f"{name}_predict_single_s"] = (
+            time_call(
+                lambda: [classifier.predict(queries[row]) for row in range(200)],
+                repeat=3,
+            )
+            / 200
+        )
+        results[f"{name}_predict_batch_s"] = time_call(
+            classifier.predict, queries, repeat=3
+        )
+        results[f"{name}_accuracy"] = (predictions[name] == features.y_test).mean()
+
+    (brute_distances, brute_indices), (distances, indices) = neighbors.values()
+    results["recall"] = (
+        np.mean(
+            [len(set(row) & set(other)) for row, other in zip(brute_indices, indices)]
+        )
+        / indices.shape[1]
+    )
+    results["distance_recall"] = (
+        np.isclose(brute_distances, distances).all(axis=1).mean()
+    )
+    results["agreement"] = (predictions["brute"] == predictions["sparse"]).mean()
+    return results
+
+
+def scripted_transition(script, model, seed=SEED):
+    """
+    Run the dialog system in the terminal from start to end, with scripted input.
+
+    The recommendations are sampled with NumPy, which is seeded so every run takes
+    the same path through the dialog.
+    """
+    import builtins
+    import contextlib
+    import io
+
+    import numpy as np
+
+    import dialog_system
+
+    replies = iter(script)
+
+    def scripted_input(prompt=""):
+        for reply in replies:
+            return reply
+        raise AssertionError("Dialog asked for more input than the script has")
+
+    original_input = builtins.input
+    builtins.input = scripted_input
+    random_state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            dialog_system.transition(dialog_system.welcome, model=model)
+    finally:
+        builtins.input = original_input
+        np.random.set_state(random_state)
+
+
+# User turns of a dialog that runs from the welcome state to the bye state
+TRANSITION_SCRIPT = [
+    "i want cheap chinese food in the centre",
+    "touristic",
+    "what is the address and phone number",
+    "thank you good bye",
+]
+
+
+@benchmark
+def transition():
+    """Time one full scripted dialog, with and without the prediction cache."""
+    from dialog_system import get_model
+
+    model = get_model()
+    return {
+        "n_turns": len(TRANSITION_SCRIPT),
+        "transition_s": time_call(
+            scripted_transition, TRANSITION_SCRIPT, model, number=20
+        ),
+        "transition_uncached_s": time_call(
+            scripted_transition, TRANSITION_SCRIPT, model.model, number=20
+        ),
+    }
+
+
+def run(names):
+    """Run benchmarks by name, print their results, and return them by name."""
+    results = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            raise SystemExit(f"Unknown benchmark {name}, pick from {list(BENCHMARKS)}")
+        print(f"{name}:")
+        results[name] = {}
+        for metric, value in BENCHMARKS[name]().items():
+            # NumPy scalars are converted, so results can be written as JSON
+            value = value.item() if hasattr(value, "item") else value
+            results[name][metric] = value
+            formatted = f"{value:.6g}" if isinstance(value, float) else value
+            print(f"    {metric}: {formatted}")
+    return results
+
+
+def save_results(results, path):
+    """Write benchmark results to a JSON file, with the machine they ran on."""
+    import platform
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": SEED,
+        "benchmarks": results,
+    }
+    with open(path, "w") as file:
+        json.dump(report, file, indent=4)
+
+
+def load_results(path):
+    """Read the benchmark results of a JSON file written by save_results."""
+    with open(path) as file:
+        return json.load(file)["benchmarks"]
+
+
+def lower_is_better(metric):
+    """
+    Whether a lower value of a metric is better, or None if it is not compared.
+
+    Throughputs end in _per_s, times in _s and memory in _mb or _kb.
+    """
+    if metric.endswith("_per_s"):
+        return False
+    if metric.endswith(("_s", "_mb", "_kb")):
+        return True
+    return None
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Compare the metrics that two runs have in common.
+
+    Returns a row for each metric, with its relative change, and whether it got
+    worse by more than threshold.
+    """
+    rows = []
+    for name, metrics in current.items():
+        for metric, value in metrics.items():
+            direction = lower_is_better(metric)
+            old = baseline.get(name, {}).get(metric)
+            if direction is None or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            regression = change > threshold if direction else change < -threshold
+            rows.append((name, metric, old, value, change, regression))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("names", nargs="*", help="benchmarks to run, by default all")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE",
+        help="compare the results with those of a JSON file, and flag regressions",
+    )
+    parser.add_argument(
+        "--current",
+        help="JSON file with the results to compare, instead of running benchmarks",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative change of a metric that counts as a regression",
+    )
+    args = parser.parse_args()
+
+    if args.current:
+        results = load_results(args.current)
+    else:
+        results = run(args.names or list(BENCHMARKS))
+    if args.output:
+        save_results(results, args.output)
+        print(f"Saved results to {args.output}.")
+
+    if args.compare:
+        from prettytable import PrettyTable
+
+        rows = compare(load_results(args.compare), results, args.threshold)
+        table = PrettyTable(
+            ["Benchmark", "Metric", "Baseline", "Current", "Change", ""]
+        )
+        for name, metric, old, new, change, regression in rows:
+            table.add_row(
+                [
+                    name,
+                    metric,
+                    f"{old:.6g}",
+                    f"{new:.6g}",
+                    f"{change * 100:+.1f}%",
+                    "REGRESSION" if regression else "",
+                ]
+            )
+        print(table.get_string())
+        regressions = sum(row[-1] for row in rows)
+        print(
+            f"{regressions} of {len(rows)} metrics regressed by more than "
+            f"{args.threshold * 100:.0f}%."
+        )
+        if regressions:
+            sys.exit(1)
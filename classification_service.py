@@ -0,0 +1,244 @@
+"""
+Micro-batching classification service that sits in front of a dialog act model.
+
+Sentences submitted by many concurrent sessions are queued, and flushed to the model
+as one batched predict call once a size or time window is reached.
+"""
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+# Sentinel that tells the worker thread to flush what is left and stop
+_STOP = object()
+
+
+class _Request:
+    """A single sentence that is waiting to be classified."""
+
+    __slots__ = ("sentence", "future", "submitted")
+
+    def __init__(self, sentence):
+        self.sentence = sentence
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of some values, fraction should be in [0, 1]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class ClassificationService:
+    """
+    Long-running in-process service that classifies sentences in batches.
+
+    A background thread collects submitted sentences, and calls model.predict
+    once max_batch_size sentences are waiting, or once the oldest sentence in
+    the batch has waited max_wait seconds. Callers get a future for each
+    sentence. Latency and batch size of the last stats_window requests are kept,
+    to tune the window under real load.
+    """
+
+    def __init__(self, model, max_batch_size=64, max_wait=0.002, stats_window=10000):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = queue.Queue()
+        self._thread = None
+        # Guards the thread and stopping flag, so nothing is queued after _STOP
+        self._running_lock = threading.Lock()
+        self._stopping = False
+        self._lock = threading.Lock()
+
+        # Rolling statistics
+        self._latencies = deque(maxlen=stats_window)
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._n_requests = 0
+        self._n_batches = 0
+
+    def start(self):
+        """Start the worker thread, if it is not running already."""
+        with self._running_lock:
+            if self._stopping:
+                raise RuntimeError("Service is stopping")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="classification-service", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Classify everything that is still queued, and stop the worker thread.
+
+        Sentences that are submitted once the service is stopping are rejected.
+        """
+        with self._running_lock:
+            thread = self._thread
+            if thread is None or self._stopping:
+                return
+            self._stopping = True
+            self._queue.put(_STOP)
+        thread.join()
+
+        # Fail what the worker left, e.g. if it died, so no caller waits forever
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not _STOP and request.future.set_running_or_notify_cancel():
+                request.future.set_exception(RuntimeError("Service was stopped"))
+        with self._running_lock:
+            self._thread = None
+            self._stopping = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def classes_(self):
+        """Classes of the underlying model."""
+        return self.model.classes_
+
+    def submit(self, sentence):
+        """Queue a sentence for classification, returns a future of its label."""
+        request = _Request(sentence)
+        with self._running_lock:
+            if self._thread is None or self._stopping:
+                raise RuntimeError("Service is not running, call start() first")
+            self._queue.put(request)
+        return request.future
+
+    def predict(self, sentences):
+        """
+        Blocking drop-in for model.predict.
+
+        Allows the service to be passed as the model to dialog_system.transition.
+        """
+        futures = [self.submit(sentence) for sentence in sentences]
+        return np.array([future.result() for future in futures])
+
+    def _run(self):
+        """Worker loop that gathers requests into batches and flushes them."""
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = first.submitted + self.max_wait
+
+            # Keep collecting until the batch is full or the window has passed
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout > 0:
+                        request = self._queue.get(timeout=timeout)
+                    else:
+                        request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """Classify a batch with a single predict call, and resolve its futures."""
+        # Skip requests whose callers cancelled them in the meantime
+        batch = [req for req in batch if req.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            labels = self.model.predict([req.sentence for req in batch])
+        except Exception as exc:
+            for request in batch:
+                request.future.set_exception(exc)
+            return
+
+        done = time.perf_counter()
+        with self._lock:
+            self._n_requests += len(batch)
+            self._n_batches += 1
+            self._batch_sizes.append(len(batch))
+            self._latencies.extend(done - req.submitted for req in batch)
+
+        for request, label in zip(batch, labels):
+            request.future.set_result(label)
+
+    def stats(self):
+        """Latency (in seconds) and batch size statistics of recent requests."""
+        with self._lock:
+            latencies = list(self._latencies)
+            batch_sizes = list(self._batch_sizes)
+            n_requests, n_batches = self._n_requests, self._n_batches
+        return {
+            "requests": n_requests,
+            "batches": n_batches,
+            "latency_p50": percentile(latencies, 0.50),
+            "latency_p99": percentile(latencies, 0.99),
+            "batch_size_mean": (
+                sum(batch_sizes) / len(batch_sizes) if batch_sizes else None
+            ),
+            "batch_size_p50": percentile(batch_sizes, 0.50),
+            "batch_size_max": max(batch_sizes, default=None),
+        }
+
+    def reset_stats(self):
+        """Forget all statistics gathered so far."""
+        with self._lock:
+            self._latencies.clear()
+            self._batch_sizes.clear()
+            self._n_requests = 0
+            self._n_batches = 0
+
+
+if __name__ == "__main__":
+    # Simulate many concurrent sessions, to tune the batching window.
+    from extract import read_dialog_data
+    from machine_learning import load_model
+
+    n_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    turns_per_session = 50
+    sentences, _ = read_dialog_data()
+    model = load_model("log_reg.pickle")
+
+    def session(service, offset):
+        """Classify turns one at a time, like a dialog session would."""
+        for turn in range(turns_per_session):
+            sentence = sentences[(offset * turns_per_session + turn) % len(sentences)]
+            service.predict([sentence])
+
+    print(f"Simulating {n_sessions} sessions of {turns_per_session} turns each")
+    for max_batch_size, max_wait in [(1, 0.0), (16, 0.001), (64, 0.002), (256, 0.005)]:
+        with ClassificationService(model, max_batch_size, max_wait) as service:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(n_sessions) as pool:
+                list(pool.map(lambda i: session(service, i), range(n_sessions)))
+            elapsed = time.perf_counter() - start
+        stats = service.stats()
+        print(
+            f"batch<={max_batch_size:<4} wait={max_wait * 1000:.1f}ms: "
+            f"{stats['requests'] / elapsed:8.0f} sentences/s, "
+            f"p50={stats['latency_p50'] * 1000:.2f}ms, "
+            f"p99={stats['latency_p99'] * 1000:.2f}ms, "
+            f"mean batch={stats['batch_size_mean']:.1f}"
+        )
@@ -0,0 +1,133 @@
+"""
+Statistics of the dialog data, computed in one streaming pass.
+
+A CorpusStats accumulates the sentence lengths, labels and vocabularies of chunks of
+the data, and stats of separate chunks can be merged. So chunks are read one at a
+time, counted in parallel over a pool of processes, and combined, and memory only
+grows with the vocabulary, not with the amount of data. Sentences are split into a
+train and test set by hashing them, like extract.is_test_sentence.
+"""
+import os
+import re
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from extract import DIALOG_ACTS_FILE, is_test_sentence, iter_dialog_chunks
+
+# Words like CountVectorizer tokenizes them, so vocabularies match those of models
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+class CorpusStats:
+    """
+    Mergeable statistics of sentences and their labels.
+
+    The mean and variance of the number of words per sentence are kept with the
+    parallel algorithm of Chan et al., so merging stats is exact.
+    """
+
+    def __init__(self, test_size=0.15, seed=42):
+        self.test_size = test_size
+        self.seed = seed
+        self.n_sentences = 0
+        self.mean_length = 0.0
+        # Sum of squared differences from the mean length
+        self.m2_length = 0.0
+        self.lengths = Counter()
+        self.labels = Counter()
+        self.train_words = Counter()
+        self.test_words = Counter()
+
+    def _merge_lengths(self, n, mean, m2):
+        """Combine the length moments of n other sentences into these."""
+        total = self.n_sentences + n
+        if total == 0:
+            return
+        delta = mean - self.mean_length
+        self.mean_length += delta * n / total
+        self.m2_length += m2 + delta**2 * self.n_sentences * n / total
+        self.n_sentences = total
+
+    def update(self, sentences, labels):
+        """Add a chunk of sentences and their labels."""
+        lengths = [len(sentence.split()) for sentence in sentences]
+        if not lengths:
+            return self
+        mean = sum(lengths) / len(lengths)
+        m2 = sum((length - mean) ** 2 for length in lengths)
+        self._merge_lengths(len(lengths), mean, m2)
+        self.lengths.update(lengths)
+        self.labels.update(labels)
+        for sentence in sentences:
+            words = TOKEN_PATTERN.findall(sentence.lower())
+            if is_test_sentence(sentence, self.test_size, self.seed):
+                self.test_words.update(words)
+            else:
+                self.train_words.update(words)
+        return self
+
+    def merge(self, other):
+        """Add the stats of other chunks, of the same split."""
+        if (other.test_size, other.seed) != (self.test_size, self.seed):
+            raise ValueError("Can not merge stats of different splits")
+        self._merge_lengths(other.n_sentences, other.mean_length, other.m2_length)
+        self.lengths.update(other.lengths)
+        self.labels.update(other.labels)
+        self.train_words.update(other.train_words)
+        self.test_words.update(other.test_words)
+        return self
+
+    @property
+    def std_length(self):
+        """Standard deviation of the number of words per sentence, like np.std."""
+        if self.n_sentences == 0:
+            return 0.0
+        return (self.m2_length / self.n_sentences) ** 0.5
+
+    @property
+    def out_of_vocabulary(self):
+        """Words of the test set that are not in the vocabulary of the train set."""
+        return Counter(
+            {
+                word: count
+                for word, count in self.test_words.items()
+                if word not in self.train_words
+            }
+        )
+
+    @property
+    def unseen_in_test(self):
+        """Words of the train set that do not occur in the test set."""
+        return self.train_words.keys() - self.test_words.keys()
+
+
+def _chunk_stats(args):
+    """Stats of one chunk, in a worker process."""
+    sentences, labels, test_size, seed = args
+    return CorpusStats(test_size, seed).update(sentences, labels)
+
+
+def corpus_stats(
+    paths=DIALOG_ACTS_FILE, chunk_size=10000, processes=None, test_size=0.15, seed=42
+):
+    """
+    Compute the stats of dialog data files, in chunks over a pool of processes.
+
+    Only a few chunks per process are read ahead, so memory stays bounded however
+    large the files are.
+    """
+    processes = processes or os.cpu_count()
+    stats = CorpusStats(test_size, seed)
+    with ProcessPoolExecutor(processes) as executor:
+        pending = set()
+        for sentences, labels in iter_dialog_chunks(paths, chunk_size):
+            pending.add(
+                executor.submit(_chunk_stats, (sentences, labels, test_size, seed))
+            )
+            if len(pending) >= 2 * processes:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stats.merge(future.result())
+        for future in pending:
+            stats.merge(future.result())
+    return stats
@@ -0,0 +1,175 @@
+"""
+Script that cross-validates all models and the rule based baseline.
+
+The dialog data is split into stratified folds, that run in parallel over a pool of
+processes. Each fold is vectorized once, and shared by all models. Reports the mean
+and variance of the accuracy and F-score of each model, and its fit and predict
+times per fold.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from prettytable import PrettyTable
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold
+
+from baseline import assign_rule_based, get_most_frequent
+from extract import read_dialog_data
+from machine_learning import MODELS
+
+RULE_BASED = "Rule based baseline"
+
+# Data of a worker process, set once when the process starts
+_sentences = None
+_labels = None
+
+
+def _init_worker(sentences, labels):
+    """Keep the data in a worker, so folds only send their indices."""
+    global _sentences, _labels
+    _sentences, _labels = sentences, labels
+
+
+def score(model_name, fold, y_true, y_pred, fit_time, predict_time):
+    """Row of scores and times of a model on a fold."""
+    return {
+        "model": model_name,
+        "fold": fold,
+        "accuracy": accuracy_score(y_true, y_pred),
+        "f1": f1_score(y_true, y_pred, average="weighted", zero_division=1),
+        "fit_s": fit_time,
+        "predict_s": predict_time,
+    }
+
+
+def _run_fold(fold, train_idx, test_idx, models):
+    """Vectorize a fold once, then fit and score all models and the baseline on it."""
+    x_train, x_test = _sentences[train_idx], _sentences[test_idx]
+    y_train, y_test = _labels[train_idx], _labels[test_idx]
+
+    vectorizer = CountVectorizer()
+    features_train = vectorizer.fit_transform(x_train)
+    features_test = vectorizer.transform(x_test)
+
+    rows = []
+    for name, _, classifier_model in models:
+        start = time.perf_counter()
+        classifier = classifier_model().fit(features_train, y_train)
+        fit_time = time.perf_counter() - start
+        start = time.perf_counter()
+        y_pred = classifier.predict(features_test)
+        predict_time = time.perf_counter() - start
+        rows.append(score(name, fold, y_test, y_pred, fit_time, predict_time))
+
+    # The baseline only learns the most frequent label, and needs no features
+    start = time.perf_counter()
+    most_frequent = get_most_frequent(y_train)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    y_pred = assign_rule_based(x_test, most_frequent=most_frequent, columnar=True)
+    predict_time = time.perf_counter() - start
+    rows.append(score(RULE_BASED, fold, y_test, y_pred, fit_time, predict_time))
+    return rows
+
+
+def _run_fold_args(args):
+    """Entry point of a worker process."""
+    return _run_fold(*args)
+
+
+def cross_validate(sentences, labels, n_folds=5, models=MODELS, processes=None):
+    """
+    Score models on stratified folds, in parallel.
+
+    Returns a DataFrame with a row of scores and times for each model and fold.
+    """
+    sentences, labels = np.asarray(sentences), np.asarray(labels)
+    folds = StratifiedKFold(n_folds, shuffle=True, random_state=42)
+    tasks = [
+        (fold, train_idx, test_idx, models)
+        for fold, (train_idx, test_idx) in enumerate(folds.split(sentences, labels))
+    ]
+    with ProcessPoolExecutor(
+        processes, initializer=_init_worker, initargs=(sentences, labels)
+    ) as executor:
+        rows = [row for rows in executor.map(_run_fold_args, tasks) for row in rows]
+    return pd.DataFrame(rows)
+
+
+def summarize(results):
+    """Mean and variance of the scores of each model, and its mean times per fold."""
+    summary = results.groupby("model", sort=False).agg(
+        accuracy_mean=("accuracy", "mean"),
+        accuracy_var=("accuracy", "var"),
+        f1_mean=("f1", "mean"),
+        f1_var=("f1", "var"),
+        fit_s=("fit_s", "mean"),
+        predict_s=("predict_s", "mean"),
+    )
+    return summary.sort_values("f1_mean", ascending=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    sentences, labels = read_dialog_data()
+    print(f"Cross-validating {len(MODELS)} models and the baseline...")
+    start = time.perf_counter()
+    results = cross_validate(sentences, labels, args.folds, processes=args.processes)
+    elapsed = time.perf_counter() - start
+
+    table = PrettyTable(
+        [
+            "Model",
+            "Accuracy",
+            "Accuracy var",
+            "F-score",
+            "F-score var",
+            "Fit time",
+            "Predict time",
+        ]
+    )
+    for name, row in summarize(results).iterrows():
+        table.add_row(
+            [
+                name,
+                f"{row.accuracy_mean * 100:.2f}%",
+                f"{row.accuracy_var:.2e}",
+                f"{row.f1_mean * 100:.2f}%",
+                f"{row.f1_var:.2e}",
+                f"{row.fit_s:.3f}s",
+                f"{row.predict_s:.4f}s",
+            ]
+        )
+    print(table.get_string())
+
+    print("Scores and times per fold:")
+    fold_table = PrettyTable(
+        ["Model", "Fold", "Accuracy", "F-score", "Fit time", "Predict time"]
+    )
+    for row in results.itertuples():
+        fold_table.add_row(
+            [
+                row.model,
+                row.fold,
+                f"{row.accuracy * 100:.2f}%",
+                f"{row.f1 * 100:.2f}%",
+                f"{row.fit_s:.3f}s",
+                f"{row.predict_s:.4f}s",
+            ]
+        )
+    print(fold_table.get_string(sortby="Model"))
+    print(f"Cross-validated in {elapsed:.2f}s")
+
+    RESULTS_DIR = "results"
+    results_path = os.path.join(RESULTS_DIR, "cross_validation.csv")
+    results.to_csv(results_path, index=False)
+    print(f"Saved the scores of every fold to {results_path}.")
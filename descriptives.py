@@ -1,55 +1,60 @@
-import os
+"""
+Script that describes the dialog data, its sentence lengths, labels and vocabulary.
 
-from extract import create_dialog_dataset
+The data is read in one streaming pass, in chunks that are counted in parallel, see
+corpus_stats.py. The train and test sets are split by hashing sentences.
+"""
+import argparse
+import os
 
-import numpy as np
-import pandas as pd
+from corpus_stats import corpus_stats
+from extract import DIALOG_ACTS_FILE
 
 import matplotlib.pyplot as plt
 from prettytable import PrettyTable
-from sklearn.feature_extraction.text import CountVectorizer
 
 if __name__ == "__main__":
-    # Load data
-    x_train, x_test, y_train, y_test = create_dialog_dataset()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--data", nargs="+", default=[DIALOG_ACTS_FILE], help="data files to read"
+    )
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
 
-    # Add back together entire dataset
-    all_x = np.concatenate([x_train, x_test])
-    all_y = np.concatenate([y_train, y_test])
-
-    # Get word lengths
-    len_vect = np.vectorize(len)
-    words = [sent.split() for sent in all_x]
-    lengths = len_vect(np.array(words, dtype="object"))
-    sorted_lens = np.sort(lengths)
+    # Count all statistics in one pass over the data
+    stats = corpus_stats(args.data, args.chunk_size, args.processes)
+    if stats.n_sentences == 0:
+        raise SystemExit("No sentences in the data files, nothing to describe")
+    max_length = max(stats.lengths)
 
     # Create histogram that shows word length
     utt_fig, utt_ax = plt.subplots()
-    utt_ax.hist(sorted_lens, bins=np.arange(0.5, lengths.max(), 1), rwidth=0.5)
+    utt_ax.bar(list(stats.lengths), list(stats.lengths.values()), width=0.5)
     utt_ax.set_title("Histrogram sentence utterence length.")
     utt_ax.set_xlabel("Utterance length in amount of words")
     utt_ax.set_ylabel("Frequency in the data")
-    utt_ax.set_xticks(np.arange(1, lengths.max(), 1))
+    utt_ax.set_xticks(range(1, max_length + 1))
 
     # Create table and data to show label distribution
     training_tabel = PrettyTable(["Label", "N occurences"])
-    values, n_occ = np.unique(all_y, return_counts=True)
-    rows = np.column_stack((values, n_occ))
-    training_tabel.add_rows(rows)
-
-    # Init count vectorizer to compare in and out of vocabulary words
-    vectorizer = CountVectorizer()
-    vectorizer.fit(x_train)
-    voc = vectorizer.vocabulary_
+    training_tabel.add_rows(sorted(stats.labels.items()))
 
-    test_vectorizer = CountVectorizer()
-    test_vectorizer.fit(x_test)
-    test_voc = test_vectorizer.vocabulary_
-    n_out_of_voc = len(voc.keys() - test_voc.keys())
+    # Compare in and out of vocabulary words of the test set
+    out_of_vocabulary = stats.out_of_vocabulary
 
     # Print out all results
-    print(f"Out of vocabulary words in test set: {n_out_of_voc}")
-    print(f"Amount of unique labels: {len(values)}")
+    print(f"Sentences: {stats.n_sentences}")
+    print(
+        f"Vocabulary size: train set {len(stats.train_words)}, "
+        f"test set {len(stats.test_words)}"
+    )
+    print(
+        f"Out of vocabulary words in test set: {len(out_of_vocabulary)} words, "
+        f"{sum(out_of_vocabulary.values())} occurences"
+    )
+    print(f"Words of train set that are not in test set: {len(stats.unseen_in_test)}")
+    print(f"Amount of unique labels: {len(stats.labels)}")
     print("Training data label distribution")
     print(training_tabel.get_string())
 
@@ -57,5 +62,8 @@ if __name__ == "__main__":
     PLOT_DIR = "plots"
     path = os.path.join(PLOT_DIR, "utterence_length_hist.png")
     utt_fig.savefig(path, dpi=300, bbox_inches="tight")
-    print(f"Average sentence length in words: M={lengths.mean()}, SD={lengths.std()}")
+    print(
+        "Average sentence length in words: "
+        f"M={stats.mean_length}, SD={stats.std_length}"
+    )
     print(f"Saved histogram of utterence lengths to {path}")
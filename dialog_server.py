@@ -0,0 +1,241 @@
+"""
+Asyncio dialog engine, that runs many conversations with the dialog system at once.
+
+Each session runs the steps of the same state graph as the terminal dialog system,
+but is driven by incoming messages rather than input(). The dialog acts of all
+sessions are classified in batches by a ClassificationService.
+Run this file to serve sessions on a local socket, one per connection, or pass
+--stdin to multiplex sessions over JSON lines on stdin and stdout.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import sys
+
+from classification_service import ClassificationService
+from dialog_system import Classify, Notice, dialog, get_model, welcome
+from tracing import JsonLinesHook, Tracer
+
+
+class DialogSession:
+    """The state of one conversation, which is its running dialog steps."""
+
+    def __init__(self, session_id, steps):
+        self.session_id = session_id
+        self.steps = steps
+        self.finished = False
+        self.turns = 0
+
+
+class DialogEngine:
+    """
+    Engine that keeps a table of sessions, and responds to their messages.
+
+    Use it as an async context manager, so the classification service is running.
+    """
+
+    def __init__(
+        self, model=None, start_state=welcome, max_batch_size=64, tracer=None, **kwargs
+    ):
+        self.start_state = start_state
+        self.tracer = tracer
+        self.sessions = {}
+        self.service = ClassificationService(
+            get_model() if model is None else model, max_batch_size, **kwargs
+        )
+
+    async def __aenter__(self):
+        self.service.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.sessions.clear()
+        self.service.stop()
+
+    async def open(self, session_id):
+        """Start a new session, returns the first response of the dialog system."""
+        if session_id in self.sessions:
+            raise KeyError(f"Session {session_id} already exists")
+        session = DialogSession(
+            session_id, dialog(self.start_state, tracer=self.tracer)
+        )
+        self.sessions[session_id] = session
+        return await self._advance(session, None)
+
+    async def handle(self, session_id, message):
+        """Respond to a message of a session, the session is closed when it ends."""
+        session = self.sessions[session_id]
+        session.turns += 1
+        return await self._advance(session, message)
+
+    @staticmethod
+    def _step(steps, reply):
+        """Send a reply to some steps, returns their next request or StopIteration."""
+        try:
+            return steps.send(reply)
+        except StopIteration as stop:
+            # Futures can not be resolved with StopIteration, so it is returned
+            return stop
+
+    def close(self, session_id):
+        """Forget a session, whether it has finished or not."""
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.steps.close()
+
+    async def _advance(self, session, reply):
+        """
+        Run the steps of a session until they need the next message.
+
+        The steps run in a thread of the event loop, so slow queries of one session
+        do not hold up the others. If they fail, the session is closed.
+        """
+        loop = asyncio.get_running_loop()
+        responses = []
+        while True:
+            try:
+                request = await loop.run_in_executor(
+                    None, self._step, session.steps, reply
+                )
+            except Exception:
+                self.close(session.session_id)
+                raise
+            if isinstance(request, StopIteration):
+                session.finished = True
+                self.sessions.pop(session.session_id, None)
+                return "".join(responses)
+
+            if isinstance(request, Classify):
+                future = self.service.submit(request.sentence)
+                reply = await asyncio.wrap_future(future)
+            elif isinstance(request, Notice):
+                responses.append(request)
+                reply = None
+            else:
+                responses.append(request)
+                return "".join(responses)
+
+
+async def serve_socket(engine, host, port):
+    """Serve one session for each connection to a local socket."""
+    session_ids = itertools.count()
+
+    async def handle_connection(reader, writer):
+        session_id = next(session_ids)
+        try:
+            writer.write((await engine.open(session_id)).encode())
+            while session_id in engine.sessions:
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    break
+                message = line.decode().rstrip("\r\n")
+                writer.write((await engine.handle(session_id, message)).encode())
+            await writer.drain()
+        finally:
+            engine.close(session_id)
+            writer.close()
+
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f"Serving dialog sessions on {host}:{port}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_stdin(engine):
+    """
+    Serve sessions that are multiplexed over JSON lines on stdin and stdout.
+
+    A line {"session": id} opens a session, {"session": id, "message": text} sends a
+    message. Each line is answered with {"session": id, "response": text, "finished":
+    bool}, or {"session": id, "error": text}. A session that fails is closed, and
+    lines that are not such requests are answered with an error too.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+    )
+    pending = set()
+
+    async def respond(request):
+        session_id = request["session"]
+        try:
+            if "message" in request:
+                response = await engine.handle(session_id, request["message"])
+            else:
+                response = await engine.open(session_id)
+            result = {
+                "session": session_id,
+                "response": response,
+                "finished": session_id not in engine.sessions,
+            }
+        except KeyError as error:
+            result = {"session": session_id, "error": str(error)}
+        except Exception as error:
+            # The engine closed the session, the others keep running
+            result = {
+                "session": session_id,
+                "error": f"{type(error).__name__}: {error}",
+            }
+        print(json.dumps(result), flush=True)
+
+    # Sessions are handled concurrently, but a session handles one line at a time
+    locks = {}
+
+    async def respond_in_order(line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+            if not isinstance(request.get("session"), (str, int)):
+                raise ValueError('expected a string or integer "session"')
+            if not isinstance(request.get("message", ""), str):
+                raise ValueError('expected a string "message"')
+        except ValueError as error:
+            print(json.dumps({"session": None, "error": str(error)}), flush=True)
+            return
+        session_id = request["session"]
+        async with locks.setdefault(session_id, asyncio.Lock()):
+            await respond(request)
+        if session_id not in engine.sessions:
+            locks.pop(session_id, None)
+
+    while line := await reader.readline():
+        if line.strip():
+            task = asyncio.create_task(respond_in_order(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    await asyncio.gather(*pending)
+
+
+async def main(args):
+    """Run the engine behind the selected transport."""
+    with contextlib.ExitStack() as stack:
+        tracer = None
+        if args.trace:
+            trace_file = stack.enter_context(open(args.trace, "a", buffering=1))
+            tracer = Tracer([JsonLinesHook(trace_file)])
+        async with DialogEngine(
+            max_batch_size=args.batch_size, tracer=tracer
+        ) as engine:
+            if args.stdin:
+                await serve_stdin(engine)
+            else:
+                await serve_socket(engine, args.host, args.port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stdin", action="store_true", help="serve JSON lines")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--trace", help="append the spans of each turn as JSON lines")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
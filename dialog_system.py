@@ -4,33 +4,169 @@ attempts to suggest a restaurant that matches these specifications.
 """
 
 import abc
+import copy
+import functools
 import math
-from typing import Optional
+import os
+from typing import Optional, Tuple, TYPE_CHECKING
 
-from machine_learning import load_model
-from extract import read_augmented_restaurant_dataset
 from dataclasses import dataclass
+
+import tracing
 from templates import (
+    ask_confirmation,
+    confirmation_prompt,
     match_area,
     match_food,
     match_pricerange,
     match_request,
-    match_food,
     match_consequent,
 )
 
-import numpy as np
-import pandas as pd
+if TYPE_CHECKING:
+    import pandas as pd
 
-log_reg = load_model("log_reg.pickle")
+# Directory and file of the model that classifies the dialog act of user inputs
+MODEL_DIR = "models/"
+MODEL_FILE = "log_reg.model"
 
-data = read_augmented_restaurant_dataset()
+# Number of predictions that each process caches, and a SQLite file to share them
+# between processes, which is off unless PREDICTION_CACHE_FILE is set
+PREDICTION_CACHE_SIZE = 4096
+PREDICTION_CACHE_FILE = os.environ.get("PREDICTION_CACHE_FILE")
 
 NOT_FOUND = "NOT_FOUND"
 
 
+# The model and restaurant data are loaded on first use, rather than at import time,
+# so importing this module does not pay for pandas, sklearn or reading any files.
+@functools.lru_cache(maxsize=None)
+def get_model():
+    """
+    Get the dialog act classification model, loading it on first use.
+
+    Its predictions are cached by utterance, for the version of the model on disk.
+    """
+    from digest import path_digest
+    from model_artifact import is_artifact, load_artifact
+    from prediction_cache import PredictionCache
+
+    path = os.path.join(MODEL_DIR, MODEL_FILE)
+    if is_artifact(path):
+        model = load_artifact(path)
+    else:
+        # Pickled pipelines need sklearn, which is only imported when they are used
+        from machine_learning import load_model
+
+        model = load_model(MODEL_FILE)
+    return PredictionCache(
+        model,
+        version=f"{MODEL_FILE}-{path_digest(path)}",
+        max_size=PREDICTION_CACHE_SIZE,
+        path=PREDICTION_CACHE_FILE,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_restaurant_data():
+    """Get the restaurant data, reading it on first use."""
+    from extract import read_augmented_restaurant_dataset
+
+    return read_augmented_restaurant_dataset()
+
+
+@functools.lru_cache(maxsize=None)
+def get_restaurant_index():
+    """Get the index over the restaurant data, building it on first use."""
+    from restaurant_index import RestaurantIndex
+
+    return RestaurantIndex(get_restaurant_data())
+
+
+@functools.lru_cache(maxsize=None)
+def get_inference_engine():
+    """Get the inference engine, compiling the rules in INFERENCE_MAP on first use."""
+    return InferenceEngine(
+        INFERENCE_MAP, get_restaurant_index(), get_restaurant_data().index
+    ).compile()
+
+
+class Notice(str):
+    """A message for the user, that does not expect a reply."""
+
+
+@dataclass
+class Classify:
+    """Request to whoever runs a dialog, to reply with the dialog act of sentence."""
+
+    sentence: str
+
+    # The state that returned the sentence
+    state: Optional["StateInterface"] = None
+
+
+class ConfirmationNeeded(Exception):
+    """Raised when a template match needs the user to confirm a correction."""
+
+    def __init__(self, word, correction):
+        super().__init__(word, correction)
+        self.word = word
+        self.correction = correction
+
+
+def confirmed(match, sentence, *args):
+    """
+    Steps that run a template match, and ask the user to confirm any corrections.
+
+    The match is run again with the answers so far, until it needs no new answer.
+    """
+    answers = {}
+
+    def confirm(word, correction):
+        """Look up the answer of the user, or raise to ask for it."""
+        if (word, correction) not in answers:
+            raise ConfirmationNeeded(word, correction)
+        return answers[(word, correction)]
+
+    while True:
+        try:
+            return match(sentence, *args, confirm=confirm)
+        except ConfirmationNeeded as question:
+            reply = yield confirmation_prompt(question.word, question.correction)
+            answers[(question.word, question.correction)] = reply == "yes"
+
+
+def run_in_terminal(steps, model=None):
+    """
+    Run steps in the terminal.
+
+    Prompts are answered with input(), notices are printed, and Classify requests
+    are answered with the dialog act that model predicts. Returns what steps return.
+    """
+    reply = None
+    while True:
+        try:
+            message = steps.send(reply)
+        except StopIteration as stop:
+            return stop.value
+        if isinstance(message, Classify):
+            reply = model.predict([message.sentence])[0]
+        elif isinstance(message, Notice):
+            print(message)
+            reply = None
+        else:
+            reply = input(message)
+
+
 class StateInterface(metaclass=abc.ABCMeta):
-    """Interface that dictates any state must have a activate function."""
+    """
+    Interface that dictates any state must have a steps function.
+
+    Steps are a generator, that yields each prompt for the user and is sent the
+    user's reply, and finally returns the sentence, information and recommendations.
+    This way, states never read from the terminal themselves, so the same states can
+    be run in the terminal with activate, or by a server with many sessions.
+    """
 
     def __init__(self, number, next_state, end=False):
         """Universal init method for all state instance."""
@@ -40,14 +176,18 @@ class StateInterface(metaclass=abc.ABCMeta):
 
     @classmethod
     def __subclasshook__(cls, subclass):
-        """Classes that have a callable activate property be a valid StateInterface."""
-        return hasattr(subclass, "activate") and callable(subclass.activate)
+        """Classes that have a callable steps property be a valid StateInterface."""
+        return hasattr(subclass, "steps") and callable(subclass.steps)
 
     @abc.abstractmethod
-    def activate(self, information, recommendations):
+    def steps(self, information, recommendations):
         """Abstract method that subclasses must implement."""
         raise NotImplementedError
 
+    def activate(self, information, recommendations):
+        """Activate this state in the terminal."""
+        return run_in_terminal(self.steps(information, recommendations))
+
     def __repr__(self):
         """Representation for this class, for debugging"""
         return f"{self.__class__.__name__}(number={self.number}, end={self.end})"
@@ -71,20 +211,29 @@ class Inference:
     food_type: Optional[str] = None
     crowdedness: Optional[str] = None
 
-    def infer_from_data(self, recommendations):
-        """Infer from the data which recommendations meet our antecedent."""
-        new_rec = recommendations.copy()
+    # Other consequents and their truth value, that are also part of the antecedent
+    depends_on: Tuple[Tuple[str, bool], ...] = ()
+
+    def get_conditions(self):
+        """Get (column, value) pairs of the restaurant data that form the antecedent."""
+        conditions = []
         if self.pricerange:
-            new_rec = new_rec[new_rec["pricerange"] == self.pricerange]
+            conditions.append(("pricerange", self.pricerange))
         if self.food_type:
-            new_rec = new_rec[new_rec["food"] == self.food_type]
+            conditions.append(("food", self.food_type))
         if self.food_quality:
-            new_rec = new_rec[new_rec["food quality"] == self.food_quality]
+            conditions.append(("food quality", self.food_quality))
         if self.length_of_stay:
-            new_rec = new_rec[new_rec["length of stay"] == self.length_of_stay]
+            conditions.append(("length of stay", self.length_of_stay))
         if self.crowdedness:
-            new_rec = new_rec[new_rec["crowdedness"] == self.crowdedness]
+            conditions.append(("crowdedness", self.crowdedness))
+        return conditions
 
+    def infer_from_data(self, recommendations):
+        """Infer from the data which recommendations meet our antecedent."""
+        new_rec = recommendations
+        for column, value in self.get_conditions():
+            new_rec = new_rec[new_rec[column] == value]
         return new_rec
 
     @property
@@ -119,55 +268,17 @@ class Inferences:
     def infer(self, recommendations, truth_value):
         """
         Infer from the data the correct inference, based on the truth value
-        """
-        # Copy the current recommendations
-        new_rec = recommendations.copy()
 
+        Keeps the recommendations for which the inference with this truth value holds,
+        and the inference with the opposite truth value does not. The inferences of
+        INFERENCE_MAP use the rules that the inference engine compiled, others are
+        evaluated by the engine when they are applied.
+        """
         # Set the truth value of this inference
         self.truth_value = truth_value
-
-        # If the truth_value == True
-        if truth_value:
-
-            # If we have both an inference for True and False values
-            if self.true_inference is not None and self.false_inference is not None:
-
-                # Infer which restaurants in the data have value True
-                new_rec = self.true_inference.infer_from_data(new_rec)
-
-                # Infer which restaurants in the data have value False
-                to_remove = self.false_inference.infer_from_data(new_rec)
-
-                # Drop the resturants where the inference is False
-                # because we want only restaurants that are True
-                new_rec = new_rec.drop(index=to_remove.index)
-
-            # If we have only the true inference
-            elif self.true_inference is not None and self.false_inference is None:
-
-                # See for which
-                new_rec = self.true_inference.infer_from_data(new_rec)
-
-            # If we have only a False inference, but the truth value is True,
-            # we can't resolve the request (we don't know what it means for our
-            # inference to be True) hence, we return no results
-            elif self.true_inference is None and self.false_inference is not None:
-                new_rec = pd.DataFrame()
-
-        # Same comments as before apply, but now inversely, where True is now False
-        else:
-            if self.false_inference is not None and self.true_inference is not None:
-                new_rec = self.false_inference.infer_from_data(new_rec)
-                to_remove = self.true_inference.infer_from_data(new_rec)
-                new_rec = new_rec.drop(index=to_remove.index)
-            elif self.false_inference is not None and self.false_inference is None:
-                new_rec = self.false_inference.infer_from_data(new_rec)
-            elif self.false_inference is None and self.true_inference is not None:
-                new_rec = pd.DataFrame()
-
-        # Finally, return recommendations for which the resturants match the inference
-        # with the correct truth value.
-        return new_rec
+        return get_inference_engine().apply_inferences(
+            self, truth_value, recommendations
+        )
 
     @property
     def chosen_inference(self):
@@ -194,6 +305,167 @@ class Inferences:
             return f"has value {self.truth_value} for {self.consequent}"
 
 
+class InferenceEngine:
+    """
+    Engine that compiles inference rules into bitmaps over the restaurant data.
+
+    The bitmap of a consequent with some truth value marks the restaurants for which
+    the inference with that truth value holds, and the one with the opposite truth
+    value does not. Inferences can depend on other consequents, whose bitmaps are
+    evaluated first. Every bitmap is evaluated once and memoized, so applying a
+    requirement to recommendations is a single mask intersection.
+    """
+
+    def __init__(self, inference_map, index, labels=None):
+        self.inference_map = inference_map
+        self.index = index
+        if labels is None:
+            import pandas as pd
+
+            labels = pd.RangeIndex(index.n_rows)
+        # Labels of the rows of the restaurant data, that recommendations keep
+        self.labels = labels
+        self._masks = {}
+        self._bitmaps = {}
+
+    def antecedent_bitmap(self, inference, visiting):
+        """Get the bitmap of the restaurants that meet the antecedent of an inference."""
+        bitmap = self.index.query(inference.get_conditions())
+        for consequent, truth_value in inference.depends_on:
+            bitmap = bitmap & self.bitmap(consequent, truth_value, visiting)
+        return bitmap
+
+    def bitmap(self, consequent, truth_value, visiting=()):
+        """Get the bitmap of the restaurants where consequent has truth value."""
+        key = (consequent, truth_value)
+        if key not in self._bitmaps:
+            if key in visiting:
+                raise ValueError(f"Inference rules for {consequent} are circular")
+            self._bitmaps[key] = self.evaluate(
+                self.inference_map[consequent], truth_value, (*visiting, key)
+            )
+        return self._bitmaps[key]
+
+    def evaluate(self, inferences, truth_value, visiting=()):
+        """Get the bitmap of the restaurants where some inferences have truth value."""
+        if truth_value:
+            chosen, opposite = inferences.true_inference, inferences.false_inference
+        else:
+            chosen, opposite = inferences.false_inference, inferences.true_inference
+
+        # Without an inference for this truth value, we can't resolve it
+        if chosen is None:
+            return self.index.no_rows
+        bitmap = self.antecedent_bitmap(chosen, visiting)
+        if opposite is not None:
+            bitmap = bitmap & ~self.antecedent_bitmap(opposite, visiting)
+        return bitmap
+
+    def mask(self, consequent, truth_value):
+        """Get a boolean array over the restaurants where consequent has truth value."""
+        key = (consequent, truth_value)
+        if key not in self._masks:
+            self._masks[key] = self.index.mask(self.bitmap(consequent, truth_value))
+        return self._masks[key]
+
+    def compile(self):
+        """Evaluate the masks of all consequents for both truth values upfront."""
+        for consequent in self.inference_map:
+            for truth_value in (True, False):
+                self.mask(consequent, truth_value)
+        return self
+
+    def select(self, mask, recommendations):
+        """Keep the recommendations, which are rows of the restaurant data, in a mask."""
+        positions = self.labels.get_indexer(recommendations.index)
+        if (positions < 0).any():
+            raise ValueError("Recommendations must be rows of the restaurant data")
+        return recommendations[mask[positions]]
+
+    def apply(self, consequent, truth_value, recommendations):
+        """Keep the recommendations where consequent has truth value."""
+        return self.select(self.mask(consequent, truth_value), recommendations)
+
+    def apply_inferences(self, inferences, truth_value, recommendations):
+        """
+        Keep the recommendations where some inferences have truth value.
+
+        Inferences with the rules of the inference map, like copies of its values,
+        use the compiled masks. Other inferences are evaluated each time.
+        """
+        compiled = self.inference_map.get(inferences.consequent)
+        if (
+            compiled is not None
+            and compiled.true_inference is inferences.true_inference
+            and compiled.false_inference is inferences.false_inference
+        ):
+            return self.apply(inferences.consequent, truth_value, recommendations)
+        mask = self.index.mask(self.evaluate(inferences, truth_value))
+        return self.select(mask, recommendations)
+
+
+# Map each known consequent string that a user might type
+# to an associated set of inferences.
+INFERENCE_MAP = {
+    "touristic": Inferences(
+        "touristic",
+        Inference(
+            "touristic",
+            True,
+            "is",
+            "it serves cheap, good food",
+            pricerange="cheap",
+            food_quality="good",
+        ),
+        Inference(
+            "touristic",
+            False,
+            "is not",
+            "it serves Romanian food",
+            food_type="romanian",
+        ),
+    ),
+    "assigned seats": Inferences(
+        "assigned seats",
+        Inference(
+            "assigned seats",
+            True,
+            "has",
+            "the waiter decides where you sit",
+            crowdedness="busy",
+        ),
+    ),
+    "children": Inferences(
+        "children",
+        None,
+        Inference(
+            "children",
+            False,
+            "is not recommended for",
+            "spending a long time is not advised when taking children",
+            length_of_stay="long",
+        ),
+    ),
+    "romantic": Inferences(
+        "romantic",
+        Inference(
+            "romantic",
+            True,
+            "is",
+            "spending a long time in a restaurant is romantic",
+            length_of_stay="long",
+        ),
+        Inference(
+            "romantic",
+            False,
+            "is not",
+            "a busy restaurant is not romantic",
+            crowdedness="busy",
+        ),
+    ),
+}
+
+
 @dataclass
 class Information:
     """Models the information that a user can give us via inputted sentences"""
@@ -228,6 +500,17 @@ class Information:
         if other.food:
             self.food = other.food
 
+    def get_conditions(self):
+        """Get (column, value) pairs that the restaurant data should match."""
+        conditions = []
+        if self.pricerange:
+            conditions.append(("pricerange", self.pricerange))
+        if self.area:
+            conditions.append(("area", self.area))
+        if self.food:
+            conditions.append(("food", self.food))
+        return conditions
+
     def get_requested_columns(self):
         """Get columns from restaurant data that matches current information."""
         columns = []
@@ -249,15 +532,15 @@ class Information:
 class WelcomeState(StateInterface):
     """The state that welcomes the user, and asks for the first user input."""
 
-    def activate(self, information, recommendations):
-        sentence = input(
+    def steps(self, information, recommendations):
+        sentence = yield (
             "Hello , welcome to the Cambridge restaurant system? You can ask for "
             "restaurants by area , price range or food type . How may I help you?\n"
         )
         # Extract information from sentence
-        new_information = get_information(sentence)
+        new_information = yield from confirmed(get_information, sentence)
 
-        new_recommendations = query_information(data, new_information)
+        new_recommendations = query_information(get_restaurant_data(), new_information)
 
         return sentence.lower(), new_information, new_recommendations
 
@@ -265,29 +548,31 @@ class WelcomeState(StateInterface):
 class ByeState(StateInterface):
     """The state that says goodbye to the user."""
 
-    def activate(self, information, recommendations):
-        print("Good bye\n")
+    def steps(self, information, recommendations):
+        yield Notice("Good bye\n")
         return "", information, recommendations
 
 
 class AskPriceRangeState(StateInterface):
     """The state that asks the user for a price range preference"""
 
-    def activate(self, information, recommendations):
+    def steps(self, information, recommendations):
         sentence = ""
         # Only ask for pricerange, if we don't have one unique pricerange yet
         # in our recommendations
         if len(recommendations["pricerange"].unique()) > 1:
             # Loop while we don't know the users preference for pricerange
             while not information.pricerange:
-                sentence = input(
+                sentence = yield (
                     "Would you like something in the cheap, moderate or expensive price range?\n"
                 )
                 # Store the new value that was matched from the user input in information
-                information.pricerange = match_pricerange(sentence)
+                information.pricerange = yield from confirmed(
+                    match_pricerange, sentence
+                )
 
         # Query recommendations based on new information
-        new_recommendations = query_information(data, information)
+        new_recommendations = query_information(get_restaurant_data(), information)
         information.inferences = None
 
         return sentence.lower(), information, new_recommendations
@@ -296,34 +581,35 @@ class AskPriceRangeState(StateInterface):
 class AskTypeState(StateInterface):
     """State that asks the user for the type of food they would like."""
 
-    def activate(self, information, recommendations):
+    def steps(self, information, recommendations):
         sentence = ""
         # Only ask for food type, if we don't have a unique food yet in recommendation
         if len(recommendations["food"].unique()) > 1:
             while not information.food:
-                sentence = input("What kind of food would you like?\n")
-                information.food = match_food(sentence)
-        new_recommendations = query_information(data, information)
+                sentence = yield "What kind of food would you like?\n"
+                information.food = yield from confirmed(match_food, sentence)
+        new_recommendations = query_information(get_restaurant_data(), information)
         return sentence.lower(), information, new_recommendations
 
 
 class AskAreaState(StateInterface):
     """State that asks the user for the area of town they would prefer."""
 
-    def activate(self, information, recommendations):
+    def steps(self, information, recommendations):
         sentence = ""
         if len(recommendations["area"].unique()) > 1:
             while not information.area:
-                sentence = input("What kind of area would you like?\n")
-                information.area = match_area(sentence)
-        new_recommendations = query_information(data, information)
+                sentence = yield "What kind of area would you like?\n"
+                information.area = yield from confirmed(match_area, sentence)
+        new_recommendations = query_information(get_restaurant_data(), information)
         return sentence.lower(), information, new_recommendations
 
 
 class RecommendPlaceState(StateInterface):
     """State that picks a restaurant recommendation for the user"""
 
-    def activate(self, information, recommendations):
+    def steps(self, information, recommendations):
+        data = get_restaurant_data()
         try:
             new_recommendations = recommendations.drop(index=len(data))
         except KeyError:
@@ -346,7 +632,7 @@ class RecommendPlaceState(StateInterface):
             message += ".\n"
             if information.inferences:
                 message += information.inferences.message
-            sentence = input(message)
+            sentence = yield message
             new_information = match_request(sentence, information)
             return sentence.lower(), new_information, new_recommendations
         return NOT_FOUND, information, new_recommendations
@@ -358,7 +644,7 @@ class NotFoundState(StateInterface):
     their requirements.
     """
 
-    def activate(self, information, recommendations):
+    def steps(self, information, recommendations):
         sentence = ""
         message = "There is no (other) restaurant "
         if information.pricerange:
@@ -370,16 +656,16 @@ class NotFoundState(StateInterface):
         if information.inferences:
             message += f" that {information.inferences.consequent_sent}."
         message += "\nPlease try again.\n"
-        sentence = input(message)
-        information.update(get_information(sentence))
-        return sentence.lower(), information, data
+        sentence = yield message
+        information.update((yield from confirmed(get_information, sentence)))
+        return sentence.lower(), information, get_restaurant_data()
 
 
 class RequestInformation(StateInterface):
     """State that handles when user asks for more information."""
 
-    def activate(self, information, recommendations):
-        recommendation = recommendations.loc[len(data)]
+    def steps(self, information, recommendations):
+        recommendation = recommendations.loc[len(get_restaurant_data())]
         columns = information.get_requested_columns()
 
         # Mapping from column in data to natural language
@@ -414,7 +700,7 @@ class RequestInformation(StateInterface):
         else:
             message = "I did not understand your request, please try again.\n"
 
-        sentence = input(message)
+        sentence = yield message
         information = match_request(sentence, information)
         return sentence.lower(), information, recommendations
 
@@ -425,73 +711,14 @@ class AskAdditionalRequirements(StateInterface):
     based on inference rules.
     """
 
-    def activate(self, information, recommendations):
-        # Map each known consequent string that a user might type
-        # to an associated set of inferences.
-        INFERENCE_MAP = {
-            "touristic": Inferences(
-                "touristic",
-                Inference(
-                    "touristic",
-                    True,
-                    "is",
-                    "it serves cheap, good food",
-                    pricerange="cheap",
-                    food_quality="good",
-                ),
-                Inference(
-                    "touristic",
-                    False,
-                    "is not",
-                    "it serves Romanian food",
-                    food_type="romanian",
-                ),
-            ),
-            "assigned seats": Inferences(
-                "assigned seats",
-                Inference(
-                    "assigned seats",
-                    True,
-                    "has",
-                    "the waiter decides where you sit",
-                    crowdedness="busy",
-                ),
-            ),
-            "children": Inferences(
-                "children",
-                None,
-                Inference(
-                    "children",
-                    False,
-                    "is not recommended for",
-                    "spending a long time is not advised when taking children",
-                    length_of_stay="long",
-                ),
-            ),
-            "romantic": Inferences(
-                "romantic",
-                Inference(
-                    "romantic",
-                    True,
-                    "is",
-                    "spending a long time in a restaurant is romantic",
-                    length_of_stay="long",
-                ),
-                Inference(
-                    "romantic",
-                    False,
-                    "is not",
-                    "a busy restaurant is not romantic",
-                    crowdedness="busy",
-                ),
-            ),
-        }
+    def steps(self, information, recommendations):
         if len(recommendations) == 0:
             return NOT_FOUND, information, recommendations
-        sentence = input("Do you have any additional requirements? \n")
+        sentence = yield "Do you have any additional requirements? \n"
         consequent, truth_value = match_consequent(sentence)
         if consequent is not None and consequent in INFERENCE_MAP:
-            inferences = INFERENCE_MAP[consequent]
+            # Copy, since the truth value that is set on it belongs to this dialog
+            inferences = copy.copy(INFERENCE_MAP[consequent])
             recommendations = inferences.infer(recommendations, truth_value)
             information.inferences = inferences
         return sentence.lower(), information, recommendations
@@ -507,24 +734,33 @@ def query(data, expected):
 
 
 def query_information(data, information):
-    """Query the data based on some given information."""
-    data = data.copy()
-    if information.pricerange:
-        data = query(data, ("pricerange", information.pricerange))
-    if information.area:
-        data = query(data, ("area", information.area))
-    if information.food:
-        data = query(data, ("food", information.food))
+    """
+    Query the data based on some given information.
+
+    The restaurant data is queried through its index, and only the rows that match
+    are taken from it. Any other data is filtered column by column.
+    """
+    conditions = information.get_conditions()
+    with tracing.span("query_information", rows=len(data)) as attributes:
+        if data is get_restaurant_data():
+            data = data.iloc[get_restaurant_index().select(conditions)]
+        else:
+            for condition in conditions:
+                data = query(data, condition)
+        attributes["results"] = len(data)
     return data
 
 
-def get_information(sentence):
+def get_information(sentence, confirm=ask_confirmation):
     """Update information based on a user input."""
-    return Information(
-        match_pricerange(sentence, False),
-        match_area(sentence, False),
-        match_food(sentence, False),
-    )
+    with tracing.span("get_information", words=len(sentence.split())) as attributes:
+        information = Information(
+            match_pricerange(sentence, False, confirm=confirm),
+            match_area(sentence, False, confirm=confirm),
+            match_food(sentence, False, confirm=confirm),
+        )
+        attributes["slots"] = len(information.get_conditions())
+    return information
 
 
 # Collection of states, connected together as shown in the diagram
@@ -546,48 +782,67 @@ extra_info.next_state = recommend.next_state
 welcome = WelcomeState(1, price_range)
 
 
-def transition(
-    state: StateInterface,
-    information: Information = Information(None, None, None),
-    recommendations: pd.DataFrame = pd.DataFrame({}),
-    model=log_reg,
-    verbose=False,
-):
+def get_next_state(state, sentence, dialog_act):
     """
-    Transition function for dialog management system.
+    Get the state to transition to from state, based on the dialog act of sentence.
 
-    Calls itself recursively untill it reaches some state for which end=True.
-    Activates each state, and classifies the returned sentence using some
-    classification model. Passes on all information and recommendations that were
-    generated by each state to the next state. Knows what state to transition to,
-    by transitioning to the correct state.next_state, based on dialog act.
-    Some states have only one possible next state, in this case the transition function
-    will always pick this one as the next.
+    Some states have only one possible next state, in this case that one is always
+    picked as the next.
     """
-    sentence, updated_information, new_recommendations = state.activate(
-        information, recommendations
-    )
-    dialog_act = model.predict([sentence.lower()])[0]
+    if sentence == NOT_FOUND:
+        return not_found
 
-    if not state.end:
+    # Only if we have a transition we can make, use this next state
+    if isinstance(state.next_state, dict):
 
-        if sentence != NOT_FOUND:
-            # Only if we have a transition we can make, use this next state
-            if isinstance(state.next_state, dict):
+        # Get dialog act to find out to which state to transition
+        if dialog_act in state.next_state:
+            return state.next_state[dialog_act]
 
-                # Get dialog act to find out to which state to transition
+        # If there's no next state corresponding to dialog act, repeat this state.
+        return state
+    return state.next_state
 
-                if dialog_act in state.next_state:
-                    next_state = state.next_state[dialog_act]
 
-                # If there's no next state corresponding to dialog act, repeat this
-                # state.
-                else:
-                    next_state = state
-            else:
-                next_state = state.next_state
-        else:
-            next_state = not_found
+def dialog(
+    state: StateInterface,
+    information: Optional[Information] = None,
+    recommendations: Optional["pd.DataFrame"] = None,
+    verbose=False,
+    tracer=None,
+):
+    """
+    Steps of a whole dialog, from state until some state for which end=True.
+
+    Runs the steps of each state, so it yields the prompts and notices of all states.
+    It also yields a Classify request for the sentence that each state returns, and
+    must be sent its dialog act. Passes on all information and recommendations that
+    were generated by each state to the next state, which is picked based on the
+    dialog act. Given a tracer, the steps of each state and the classification of
+    each sentence are traced.
+    """
+    if information is None:
+        information = Information(None, None, None)
+    if recommendations is None:
+        recommendations = get_restaurant_data().iloc[0:0]
+
+    while True:
+        state_name = type(state).__name__
+        sentence, information, recommendations = yield from tracing.traced_steps(
+            tracer,
+            "state.activate",
+            state.steps(information, recommendations),
+            state=state_name,
+        )
+        if state.end:
+            return information
+
+        with tracing.span(
+            "classify", tracer, state=state_name, words=len(sentence.split())
+        ) as attributes:
+            dialog_act = yield Classify(sentence.lower(), state)
+            attributes["dialog_act"] = dialog_act
+        next_state = get_next_state(state, sentence, dialog_act)
 
         # Verbosity code, toggeling how much information to print to the user.
         # Used to debug the code, and to see the path taken through the diagram.
@@ -595,19 +850,66 @@ def transition(
             print(f"Dialog act: {dialog_act}")
             print(f"Previous state: {state}")
             print(f"Next state: {next_state}")
-            print(f"Current information: {updated_information}")
-            print(f"Recommended based on information: {new_recommendations}")
-
-        # Recursively call this function with updated information
-        transition(
-            next_state,
-            information=updated_information,
-            recommendations=new_recommendations,
-            model=model,
-            verbose=verbose,
-        )
+            print(f"Current information: {information}")
+            print(f"Recommended based on information: {len(recommendations)} rows")
+        state = next_state
+
+
+def transition(
+    state: StateInterface,
+    information: Optional[Information] = None,
+    recommendations: Optional["pd.DataFrame"] = None,
+    model=None,
+    verbose=False,
+    tracer=None,
+):
+    """
+    Transition function for dialog management system.
+
+    Runs the dialog in the terminal untill it reaches some state for which end=True.
+    Activates each state, and classifies the returned sentence using some
+    classification model, to know what state to transition to.
+    By default, uses the model from get_model. Given a tracer, the steps of the
+    dialog are traced.
+    """
+    if model is None:
+        model = get_model()
+    return run_in_terminal(
+        dialog(state, information, recommendations, verbose=verbose, tracer=tracer),
+        model=model,
+    )
 
 
 if __name__ == "__main__":
-    # Activate first state
-    transition(welcome, verbose=True)
+    import argparse
+    import contextlib
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--trace", help="write the spans of each turn as JSON lines")
+    parser.add_argument("--chrome-trace", help="write a Chrome trace events file")
+    args = parser.parse_args()
+
+    hooks = []
+    with contextlib.ExitStack() as stack:
+        if args.trace:
+            hooks.append(
+                tracing.JsonLinesHook(stack.enter_context(open(args.trace, "w")))
+            )
+        if args.chrome_trace:
+            chrome_trace = tracing.ChromeTraceHook()
+            stack.callback(chrome_trace.save, args.chrome_trace)
+            hooks.append(chrome_trace)
+        summary = tracing.SummaryHook()
+        tracer = tracing.Tracer([summary] + hooks) if hooks else None
+
+        # Activate first state
+        transition(welcome, verbose=True, tracer=tracer)
+
+    if tracer is not None:
+        print("Time spent per step:")
+        for name, stats in summary.summary().items():
+            print(
+                f"    {name:<20} n={stats['count']:<4} "
+                f"mean={stats['mean_s'] * 1000:.3f}ms "
+                f"total={stats['total_s'] * 1000:.3f}ms"
+            )
@@ -0,0 +1,23 @@
+"""Content hashes of files and directories, to key caches by what is on disk."""
+import hashlib
+import os
+
+
+def file_digest(path):
+    """SHA-256 hash of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def path_digest(path):
+    """SHA-256 hash of a file, or of the names and contents of files in a directory."""
+    if not os.path.isdir(path):
+        return file_digest(path)
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        digest.update(name.encode())
+        digest.update(file_digest(os.path.join(path, name)).encode())
+    return digest.hexdigest()
@@ -1,8 +1,15 @@
-"""Script that allows user to select a model and test it's on some stats."""
+"""
+Script that allows user to select a model and test it's on some stats.
+
+Pass --all to evaluate all models at once, and compare them in one report.
+"""
+import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-from extract import create_dialog_dataset
-from machine_learning import select_model, load_model
+from feature_cache import get_features, get_predictions
+from machine_learning import MODEL_DIR, MODELS, select_model
+from profiler import stage
 
 import numpy as np
 import pandas as pd
@@ -15,86 +22,181 @@ from sklearn.metrics import (
 )
 from prettytable import PrettyTable
 
-if __name__ == "__main__":
-    # Prompt user to select model
-    model_name, filepath, _ = select_model()
-    print(f"Loading {model_name} model from disk...")
-
-    model = load_model(filepath)
+PLOT_DIR = "plots"
+RESULTS_DIR = "results"
 
-    # Create dataset
-    x_train, x_test, y_train, y_test = create_dialog_dataset()
 
-    # Predict values based on test data
-    pred = model.predict(x_test)
+def format_percentage(number):
+    """Format a number as a percentage"""
+    return f"{number * 100:.2f}%"
 
-    def format_percentage(number):
-        """Format a number as a percentage"""
-        return f"{number * 100:.2f}%"
 
-    # Obtain variables using sklearn metric function
+def label_table(labels, y_test, pred):
+    """Create a table to display information for each label."""
     prec, recall, fscore, n_occurences = precision_recall_fscore_support(
-        y_test, pred, zero_division=1
+        y_test, pred, labels=labels, zero_division=1
     )
-
-    # Create a table to display information for each label
     table = PrettyTable(["Label", "Precision", "Recall", "F-score", "N occurences"])
-    table.add_rows(
-        [row for row in zip(model.classes_, prec, recall, fscore, n_occurences)]
+    table.add_rows([row for row in zip(labels, prec, recall, fscore, n_occurences)])
+    return table
+
+
+def average_scores(y_test, pred):
+    """Accuracy, and precision, recall and F-score weighted by n occurences."""
+    prec, recall, fscore, _ = precision_recall_fscore_support(
+        y_test, pred, zero_division=1, average="weighted"
     )
+    return accuracy_score(y_test, pred), prec, recall, fscore
 
-    # Print result sin a table
-    print(f"{model_name} results:")
-    print(table.get_string())
 
-    # Init confusion matrix
+def save_confusion_matrix(model_name, labels, y_test, pred):
+    """Write out the confusion matrix of a model to a png file."""
     fig = plt.figure(figsize=(10, 10))
     ax = fig.add_subplot()
     fig.set_dpi(100)
 
-    disp = ConfusionMatrixDisplay.from_predictions(
+    ConfusionMatrixDisplay.from_predictions(
         y_test,
         pred,
-        labels=model.classes_,
+        labels=labels,
         cmap="gray",
         xticks_rotation="vertical",
         ax=ax,
     )
-
-    # Retrieve average stats for entire set, weighted by n occurences
-    prec, recall, fscore, n_occurences = precision_recall_fscore_support(
-        y_test, pred, zero_division=1, average="weighted"
-    )
-
-    # Print out stats
-    print("On average:")
-    print(f"Accuracy: {format_percentage(accuracy_score(y_test, pred))}")
-    print(f"Precision: {format_percentage(prec)}")
-    print(f"Recall: {format_percentage(recall)}")
-    print(f"F-score: {format_percentage(fscore)}")
-
-    # Write out confusion matrix to png file
-    PLOT_DIR = "plots"
     plot_path = os.path.join(PLOT_DIR, f"{model_name}_confusion_matrix.png")
     fig.savefig(
         plot_path,
         bbox_inches="tight",
         dpi=300,
     )
-    print(f"Saved confusion matrix to {plot_path}.")
+    plt.close(fig)
+    return plot_path
+
 
-    # Create csv file with results, to use for analysis
+def save_results(model_name, features, all_pred):
+    """Create csv file with results, to use for analysis."""
     df = pd.DataFrame()
-    all_x = np.concatenate([x_train, x_test])
-    all_y = np.concatenate([y_train, y_test])
-    all_pred = model.predict(all_x)
+    all_x = np.concatenate([features.sentences_train, features.sentences_test])
+    all_y = np.concatenate([features.y_train, features.y_test])
     df["sentence"] = all_x
     df["correct label"] = all_y
     df["predicted label"] = all_pred
     df["is correct"] = all_y == all_pred
-    df["is train"] = df.index < len(x_train)
+    df["is train"] = df.index < len(features.sentences_train)
 
-    RESULTS_DIR = "results"
     results_path = os.path.join(RESULTS_DIR, f"{model_name}_results.csv")
     df.to_csv(results_path)
-    print(f"Saved confusion matrix to {results_path}.")
+    return results_path
+
+
+def _predict_model(filename):
+    """Predictions of a model in a worker process, which loads the shared matrix."""
+    return get_predictions(get_features(), filename)
+
+
+def predict_models(models, processes=None):
+    """
+    Get the predictions of models for the train and test set, in parallel.
+
+    Models that are not in MODEL_DIR, or that fail to load, are left out.
+    """
+    predictions = {}
+    with ProcessPoolExecutor(processes) as executor:
+        futures = {
+            name: executor.submit(_predict_model, filename)
+            for name, filename, _ in models
+            if os.path.exists(os.path.join(MODEL_DIR, filename))
+        }
+        for name, future in futures.items():
+            try:
+                predictions[name] = future.result()
+            except Exception as error:
+                reason = str(error).splitlines()[0]
+                print(f"Skipping {name}, it could not predict: {reason}")
+    return predictions
+
+
+def compare_models(features, predictions):
+    """One report that compares the scores of models, on the train and test set."""
+    n_train = len(features.sentences_train)
+    labels = np.unique(features.y_train)
+    report = PrettyTable(
+        ["Model", "Accuracy", "Precision", "Recall", "F-score", "Train accuracy"]
+    )
+    label_scores = pd.DataFrame(index=labels)
+    for name, all_pred in predictions.items():
+        pred = all_pred[n_train:]
+        accuracy, prec, recall, fscore = average_scores(features.y_test, pred)
+        train_accuracy = accuracy_score(features.y_train, all_pred[:n_train])
+        report.add_row(
+            [name]
+            + [format_percentage(x) for x in [accuracy, prec, recall, fscore]]
+            + [format_percentage(train_accuracy)]
+        )
+        label_scores[name] = precision_recall_fscore_support(
+            features.y_test, pred, labels=labels, zero_division=1
+        )[2]
+    return report, label_scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--all", action="store_true", help="evaluate all models")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    # Load the vectorized dataset
+    with stage("load features"):
+        features = get_features()
+    y_train, y_test = features.y_train, features.y_test
+    labels = np.unique(y_train)
+
+    if args.all:
+        print(f"Evaluating {len(MODELS)} models...")
+        with stage("predict"):
+            predictions = predict_models(MODELS, args.processes)
+        with stage("score"):
+            report, label_scores = compare_models(features, predictions)
+        with stage("save results"):
+            for name, all_pred in predictions.items():
+                pred = all_pred[len(y_train) :]
+                save_confusion_matrix(name, labels, y_test, pred)
+                save_results(name, features, all_pred)
+
+        print(report.get_string())
+        print("F-score for each label:")
+        print(label_scores.round(4).to_string())
+        report_path = os.path.join(RESULTS_DIR, "model_comparison.csv")
+        with open(report_path, "w") as file:
+            file.write(report.get_csv_string())
+        label_scores.to_csv(os.path.join(RESULTS_DIR, "label_fscores.csv"))
+        print(f"Saved comparison of all models to {report_path}.")
+    else:
+        # Prompt user to select model
+        model_name, filepath, _ = select_model()
+        print(f"Loading {model_name} model from disk...")
+
+        # Predict values for all data at once, and take those of the test data
+        with stage("predict"):
+            all_pred = get_predictions(features, filepath)
+        pred = all_pred[len(y_train) :]
+
+        # Print result sin a table
+        print(f"{model_name} results:")
+        with stage("score"):
+            print(label_table(labels, y_test, pred).get_string())
+
+            # Print out stats
+            accuracy, prec, recall, fscore = average_scores(y_test, pred)
+        print("On average:")
+        print(f"Accuracy: {format_percentage(accuracy)}")
+        print(f"Precision: {format_percentage(prec)}")
+        print(f"Recall: {format_percentage(recall)}")
+        print(f"F-score: {format_percentage(fscore)}")
+
+        with stage("save results"):
+            plot_path = save_confusion_matrix(model_name, labels, y_test, pred)
+            print(f"Saved confusion matrix to {plot_path}.")
+
+            results_path = save_results(model_name, features, all_pred)
+        print(f"Saved results to {results_path}.")
@@ -1,41 +1,98 @@
 """Module to extract and load data."""
+import gzip
 import os
+import zlib
 
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 
 DATA_DIR = "data/"  # Data directory
+DIALOG_ACTS_FILE = os.path.join(DATA_DIR, "dialog_acts.dat")
 
 
-def read_dialog_data():
-    """Reads data from a path and returns the proper data structure."""
+def open_dialog_file(path):
+    """Open a file of dialog acts as text, which can be compressed with gzip."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path, "r")
 
-    filepath = os.path.join(
-        DATA_DIR, "dialog_acts.dat"
-    )  # join filename and path to obtain full system path
-    dialog_acts = []  # List to store all dialog_acts
-    sentences = []  # List to store all sentences
 
-    with open(filepath, "r") as file:  # Open file
-        lines = file.readlines()
-        for line in lines:
-            stripped = line.lower().strip()
-            split = stripped.split(" ")
-            dialog_act = split[0]
-            sentence = " ".join(split[1:])
+def is_test_sentence(sentence, test_size=0.15, seed=42):
+    """
+    Whether a sentence is in the test set, of a split that is a hash of the sentence.
 
-            # Add first word to list as dialog act
-            dialog_acts.append(dialog_act)
+    The split is deterministic without seeing the rest of the data, and sentences
+    that occur more than once are always in the same set. So test_size is the
+    fraction of distinct sentences in the test set, rather than of lines.
+    """
+    return zlib.crc32(f"{seed}:{sentence}".encode()) < test_size * 2**32
 
-            # Add the rest of the line as a string to the sentences
-            sentences.append(sentence)
+
+def iter_dialog_data(paths=DIALOG_ACTS_FILE, split=None, test_size=0.15, seed=42):
+    """
+    Read (dialog_act, sentence) pairs one at a time, from one or more files.
+
+    Lines are a dialog act followed by a sentence. Pass split="train" or "test" to
+    only read one set of the hash based split of is_test_sentence.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        with open_dialog_file(path) as file:
+            for line in file:
+                # The first word is the dialog act, the rest is the sentence
+                split_line = line.lower().strip().split(" ")
+                dialog_act = split_line[0]
+                sentence = " ".join(split_line[1:])
+                if split is not None:
+                    if is_test_sentence(sentence, test_size, seed) != (split == "test"):
+                        continue
+                yield dialog_act, sentence
+
+
+def iter_chunks(pairs, chunk_size=10000):
+    """Group (dialog_act, sentence) pairs into (sentences, dialog_acts) lists."""
+    sentences, dialog_acts = [], []
+    for dialog_act, sentence in pairs:
+        sentences.append(sentence)
+        dialog_acts.append(dialog_act)
+        if len(sentences) == chunk_size:
+            yield sentences, dialog_acts
+            sentences, dialog_acts = [], []
+    if sentences:
+        yield sentences, dialog_acts
+
+
+def iter_dialog_chunks(paths=DIALOG_ACTS_FILE, chunk_size=10000, **kwargs):
+    """Read (sentences, dialog_acts) lists of at most chunk_size lines at a time."""
+    return iter_chunks(iter_dialog_data(paths, **kwargs), chunk_size)
+
+
+def read_dialog_data(paths=DIALOG_ACTS_FILE, **kwargs):
+    """Reads data from a path and returns the proper data structure."""
+    sentences = []  # List to store all sentences
+    dialog_acts = []  # List to store all dialog_acts
+    for dialog_act, sentence in iter_dialog_data(paths, **kwargs):
+        sentences.append(sentence)
+        dialog_acts.append(dialog_act)
     return sentences, dialog_acts
 
 
-def create_dialog_dataset(test_size=0.15):
-    """Creates dataset by reading and splitting dataset."""
-    all_x, all_y = read_dialog_data()
+def create_dialog_dataset(test_size=0.15, paths=DIALOG_ACTS_FILE, hashed=False):
+    """
+    Creates dataset by reading and splitting dataset.
+
+    By default the split is random, pass hashed=True to split by hashing sentences.
+    """
+    if hashed:
+        x_train, y_train = read_dialog_data(paths, split="train", test_size=test_size)
+        x_test, y_test = read_dialog_data(paths, split="test", test_size=test_size)
+        return x_train, x_test, y_train, y_test
+
+    # Imported here, so reading data does not require importing sklearn
+    from sklearn.model_selection import train_test_split
+
+    all_x, all_y = read_dialog_data(paths)
     return train_test_split(all_x, all_y, test_size=test_size, random_state=42)
 
 
@@ -0,0 +1,251 @@
+"""
+Content-addressed cache of the vectorized dialog data.
+
+The train and test sets are stored as the parts of their sparse document-term
+matrices, along with their vocabulary, sentences and labels, as .npy arrays in a
+directory. The name of the directory is a hash of the contents of the data files,
+the split and the vectorizer settings, so any change to those gives a new entry,
+and repeated runs load the memory-mapped arrays instead of tokenizing again.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from digest import file_digest, path_digest
+from extract import DIALOG_ACTS_FILE, create_dialog_dataset
+
+CACHE_DIR = "cache/"
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+
+# Arrays that make up an entry besides the matrices, each stored as <name>.npy
+ARRAYS = ["terms", "sentences_train", "sentences_test", "y_train", "y_test"]
+# Parts of each sparse matrix, stored as <matrix>_<part>.npy
+MATRICES = ["x_train", "x_test"]
+MATRIX_PARTS = ["data", "indices", "indptr"]
+
+
+def vectorizer_config(vectorizer):
+    """Settings of a vectorizer, as strings, so they can be hashed and compared."""
+    params = vectorizer.get_params()
+    params.pop("vocabulary", None)
+    return {name: repr(value) for name, value in sorted(params.items())}
+
+
+def cache_key(paths, split, config):
+    """Hash of the data files, split parameters and vectorizer settings."""
+    if isinstance(paths, str):
+        paths = [paths]
+    description = {
+        "format_version": FORMAT_VERSION,
+        "data": [file_digest(path) for path in paths],
+        "split": split,
+        "vectorizer": config,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class DialogFeatures:
+    """
+    Vectorized train and test sets of the dialog data.
+
+    x_train and x_test are document-term matrices, whose columns are the terms.
+    """
+
+    def __init__(
+        self,
+        x_train,
+        x_test,
+        terms,
+        sentences_train,
+        sentences_test,
+        y_train,
+        y_test,
+        header,
+    ):
+        self.x_train = x_train
+        self.x_test = x_test
+        self.terms = terms
+        self.sentences_train = sentences_train
+        self.sentences_test = sentences_test
+        self.y_train = y_train
+        self.y_test = y_test
+        self.header = header
+
+    @property
+    def vocabulary(self):
+        """Mapping of terms to their column, like vocabulary_ of a vectorizer."""
+        return {term: column for column, term in enumerate(self.terms.tolist())}
+
+    def vectorizer(self):
+        """A fitted CountVectorizer, that gives the columns of the cached matrices."""
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        vectorizer = CountVectorizer(vocabulary=self.vocabulary)
+        # Fitting with a fixed vocabulary only sets up the vocabulary
+        return vectorizer.fit([])
+
+    def matches(self, model):
+        """Whether a pipeline vectorizes sentences into the columns of the cache."""
+        vectorizer = getattr(model, "named_steps", {}).get("vectorizer")
+        return (
+            vectorizer is not None
+            and vectorizer_config(vectorizer) == self.header["vectorizer"]
+            and vectorizer.vocabulary_ == self.vocabulary
+        )
+
+    def predict(self, model, matrix, sentences):
+        """
+        Predict with a model, on a cached matrix if it uses the same vocabulary.
+
+        Otherwise, models predict on the sentences.
+        """
+        if self.matches(model):
+            return model.named_steps["classifier"].predict(matrix)
+        return model.predict(sentences)
+
+
+def save_features(features, path):
+    """Save vectorized dialog data to a directory."""
+    os.makedirs(path, exist_ok=True)
+    for name in MATRICES:
+        matrix = getattr(features, name)
+        for part in MATRIX_PARTS:
+            np.save(
+                os.path.join(path, f"{name}_{part}.npy"),
+                getattr(matrix, part),
+                allow_pickle=False,
+            )
+    for name in ARRAYS:
+        np.save(
+            os.path.join(path, f"{name}.npy"),
+            np.asarray(getattr(features, name)).astype(str),
+            allow_pickle=False,
+        )
+    with open(os.path.join(path, HEADER_FILE), "w") as file:
+        json.dump(features.header, file, indent=4)
+
+
+def load_features(path, mmap=True):
+    """Load vectorized dialog data from a directory."""
+    with open(os.path.join(path, HEADER_FILE)) as file:
+        header = json.load(file)
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported cache version {header['format_version']}")
+
+    def load(name):
+        return np.load(
+            os.path.join(path, f"{name}.npy"),
+            mmap_mode="r" if mmap else None,
+            allow_pickle=False,
+        )
+
+    matrices = {
+        name: csr_matrix(
+            tuple(load(f"{name}_{part}") for part in MATRIX_PARTS),
+            shape=header["shapes"][name],
+            copy=False,
+        )
+        for name in MATRICES
+    }
+    arrays = {name: load(name) for name in ARRAYS}
+    return DialogFeatures(header=header, **matrices, **arrays)
+
+
+def get_features(
+    test_size=0.15, paths=DIALOG_ACTS_FILE, hashed=False, cache_dir=CACHE_DIR
+):
+    """
+    Get the vectorized dialog data, from the cache if it has been vectorized before.
+
+    The data is split like create_dialog_dataset, and vectorized with a
+    CountVectorizer that is fit on the train set.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    vectorizer = CountVectorizer()
+    split = {"test_size": test_size, "hashed": hashed}
+    config = vectorizer_config(vectorizer)
+    key = cache_key(paths, split, config)
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path):
+        return load_features(path)
+
+    sentences_train, sentences_test, y_train, y_test = create_dialog_dataset(
+        test_size, paths, hashed
+    )
+    x_train = vectorizer.fit_transform(sentences_train)
+    x_test = vectorizer.transform(sentences_test)
+    terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+    features = DialogFeatures(
+        x_train=x_train,
+        x_test=x_test,
+        terms=terms,
+        sentences_train=sentences_train,
+        sentences_test=sentences_test,
+        y_train=y_train,
+        y_test=y_test,
+        header={
+            "format_version": FORMAT_VERSION,
+            "key": key,
+            "split": split,
+            "vectorizer": config,
+            "shapes": {
+                name: list(x.shape) for name, x in zip(MATRICES, [x_train, x_test])
+            },
+        },
+    )
+
+    # Write to a temporary directory first, so other processes never see a partial
+    # entry, and an entry that another process wrote in the meantime is kept
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        save_features(features, temp_path)
+        os.rename(temp_path, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+    return load_features(path)
+
+
+def get_predictions(features, filename, cache_dir=CACHE_DIR):
+    """
+    Get the predictions of a model in MODEL_DIR for the train and test set.
+
+    Predictions of the train set come first, then those of the test set. They are
+    cached by a hash of the model and of the data, so a model is only loaded and
+    run again when one of those changed.
+    """
+    from machine_learning import MODEL_DIR, load_model
+
+    digest = path_digest(os.path.join(MODEL_DIR, filename))
+    path = os.path.join(
+        cache_dir, "predictions", f"{features.header['key']}-{digest}.npy"
+    )
+    if os.path.isfile(path):
+        return np.load(path, allow_pickle=False)
+
+    # All rows are predicted at once, so no sentence is classified twice
+    predictions = features.predict(
+        load_model(filename),
+        vstack([features.x_train, features.x_test]),
+        np.concatenate([features.sentences_train, features.sentences_test]),
+    )
+    predictions = np.asarray(predictions).astype(str)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written under a name of this process first, so readers never see part of it
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        np.save(file, predictions, allow_pickle=False)
+    os.replace(temp_path, path)
+    return predictions
@@ -0,0 +1,64 @@
+"""Deletion index, to find the known words within some edit distance of a word."""
+
+import functools
+from collections import defaultdict
+
+from Levenshtein import distance
+
+
+def deletions(word, max_deletions):
+    """All strings that are word with at most max_deletions characters deleted."""
+    variants = {word}
+    level = {word}
+    for _ in range(max_deletions):
+        level = {
+            variant[:idx] + variant[idx + 1 :]
+            for variant in level
+            for idx in range(len(variant))
+        }
+        variants |= level
+    return variants
+
+
+class FuzzyIndex:
+    """
+    Symmetric deletion index over a vocabulary, like SymSpell.
+
+    Two words within edit distance k share a string that both reach by deleting at
+    most k characters, since every edit deletes at most one character from each side.
+    The index maps the deletions of every known word to the word, so a search only
+    computes the distance to the words that share a deletion with the misspelling.
+    Only deletions of the first prefix_length characters are stored, which bounds
+    the size of the index, and still finds every candidate. Searches are cached,
+    since users tend to make the same typos.
+    """
+
+    def __init__(self, words, max_distance=3, prefix_length=7, cache_size=4096):
+        self.words = sorted(set(words))
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.index = defaultdict(list)
+        for word in self.words:
+            for variant in deletions(word[:prefix_length], max_distance):
+                self.index[variant].append(word)
+        self.search = functools.lru_cache(maxsize=cache_size)(self._search)
+
+    def _search(self, word, max_distance):
+        """
+        Find the known words within max_distance of word.
+
+        Returns a tuple of (distance, word) pairs, closest words first.
+        """
+        if max_distance > self.max_distance:
+            raise ValueError(
+                f"Index finds words within {self.max_distance}, not {max_distance}"
+            )
+        candidates = set()
+        for variant in deletions(word[: self.prefix_length], max_distance):
+            candidates.update(self.index.get(variant, ()))
+        ranked = sorted(
+            (distance(word, candidate), candidate)
+            for candidate in candidates
+            if abs(len(candidate) - len(word)) <= max_distance
+        )
+        return tuple(pair for pair in ranked if pair[0] <= max_distance)
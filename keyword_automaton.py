@@ -0,0 +1,87 @@
+"""Aho-Corasick automaton, to find the keywords of a vocabulary in a sentence."""
+
+
+def is_word_char(char):
+    """Whether a character is a word character, like \\w in a regex."""
+    return char.isalnum() or char == "_"
+
+
+def is_boundary(text, idx):
+    """Whether there is a word boundary before position idx, like \\b in a regex."""
+    before = idx > 0 and is_word_char(text[idx - 1])
+    after = idx < len(text) and is_word_char(text[idx])
+    return before != after
+
+
+class KeywordAutomaton:
+    """
+    Automaton that finds every keyword of a vocabulary in one scan of a sentence.
+
+    Keywords can consist of multiple words, and only match on word boundaries, like
+    a \\b(keyword|...)\\b regex. It is built once per vocabulary, after which the
+    cost of a scan depends on the length of the sentence, not on the vocabulary.
+    """
+
+    def __init__(self, keywords):
+        self.keyword_set = frozenset(keywords)
+        self.keywords = sorted(self.keyword_set)
+
+        # Trie of the keywords, where state 0 is the root
+        self.goto = [{}]
+        self.outputs = [[]]
+        for keyword in self.keywords:
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.outputs.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.outputs[state].append(keyword)
+
+        # Failure links, built breadth first, so each state also outputs the keywords
+        # that end in its longest proper suffix
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.outputs[child] = (
+                    self.outputs[child] + self.outputs[self.fail[child]]
+                )
+
+    def __contains__(self, keyword):
+        return keyword in self.keyword_set
+
+    def find_all(self, sentence):
+        """
+        Find all keywords in a sentence, that start and end on a word boundary.
+
+        Returns (start, keyword) pairs, ordered by start, and longest keyword first.
+        """
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        matches = []
+        state = 0
+        for idx, char in enumerate(sentence):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword in outputs[state]:
+                start = idx + 1 - len(keyword)
+                if is_boundary(sentence, start) and is_boundary(sentence, idx + 1):
+                    matches.append((start, keyword))
+        matches.sort(key=lambda match: (match[0], -len(match[1])))
+        return matches
+
+    def find(self, sentence):
+        """Find the leftmost keyword in a sentence, the longest one if there are ties."""
+        matches = self.find_all(sentence)
+        if matches:
+            return matches[0][1]
+        return None
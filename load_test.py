@@ -0,0 +1,283 @@
+"""
+Load generator that replays scripted dialogs through the dialog system.
+
+Sessions run the same state graph as the terminal dialog system, at full speed and
+without a terminal, in parallel over some processes. Reports turns per second, the
+latency of each state, and the memory that each session takes.
+Run this file with --help to see its options. Recorded dialogs can be replayed by
+passing a file with one JSON list of user turns per line.
+"""
+
+import argparse
+import json
+import multiprocessing
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+from classification_service import percentile
+from dialog_system import (
+    Classify,
+    Notice,
+    dialog,
+    get_model,
+    get_restaurant_index,
+    welcome,
+)
+
+# Scripted user turns, that together visit every state of the dialog system
+SCRIPTS = [
+    [
+        "i want something moderately priced in the west part of town",
+        "british",
+        "no",
+        "what is the phone number",
+        "thank you good bye",
+    ],
+    [
+        "hello",
+        "chep",
+        "yes",
+        "north",
+        "italian",
+        "romantic",
+        "thank you good bye",
+    ],
+    [
+        "i want cheap food",
+        "yes",
+        "no",
+        "no",
+        "centre",
+        "chinese",
+        "touristic",
+        "what is the address and postcode",
+        "how about something else",
+        "no thanks bye",
+    ],
+    ["expensive food in the south", "any", "assigned seats", "phone please", "bye"],
+    ["i am looking for korean food", "moderate", "east", "no", "thank you"],
+]
+
+
+class Replay:
+    """A session that replays a script of user turns, timing the dialog system."""
+
+    def __init__(self, script, model):
+        self.replies = iter(script)
+        self.model = model
+        self.steps = dialog(welcome)
+        self.turns = 0
+        self.finished = False
+
+        # Durations of steps since the last classification, which are attributed to
+        # the state that the next classification request comes from.
+        self.pending = []
+        self.latencies = defaultdict(list)
+
+    def advance(self, reply=None):
+        """Run the dialog system until it needs a reply, returns False when done."""
+        while True:
+            start = time.perf_counter()
+            try:
+                request = self.steps.send(reply)
+            except StopIteration:
+                self.pending.append(time.perf_counter() - start)
+                self.attribute("end")
+                self.finished = True
+                return False
+            self.pending.append(time.perf_counter() - start)
+
+            if isinstance(request, Classify):
+                self.attribute(type(request.state).__name__)
+                start = time.perf_counter()
+                reply = self.model.predict([request.sentence])[0]
+                self.latencies["classify"].append(time.perf_counter() - start)
+            elif isinstance(request, Notice):
+                reply = None
+            else:
+                return True
+
+    def attribute(self, state_name):
+        """Attribute the pending step durations to a state."""
+        if self.pending:
+            self.latencies[state_name].append(sum(self.pending))
+            self.pending = []
+
+    def turn(self):
+        """Send the next scripted turn, returns False when the session is over."""
+        reply = next(self.replies, None)
+        if reply is None:
+            self.steps.close()
+            self.finished = True
+            return False
+        self.turns += 1
+        return self.advance(reply)
+
+
+def run_sessions(scripts, n_sessions, concurrency, seed):
+    """
+    Replay n_sessions in this process, keeping concurrency sessions alive at once.
+
+    Sessions take turns round-robin, like sessions of a server would.
+    """
+    np.random.seed(seed)
+    model = get_model()
+    model.reset_stats()
+    latencies = defaultdict(list)
+    turns, errors = 0, 0
+    started = 0
+    active = []
+
+    start = time.perf_counter()
+    while started < n_sessions or active:
+        # Top up the active sessions
+        while len(active) < concurrency and started < n_sessions:
+            session = Replay(scripts[started % len(scripts)], model)
+            started += 1
+            try:
+                if session.advance():
+                    active.append(session)
+            except Exception:
+                errors += 1
+
+        still_active = []
+        for session in active:
+            try:
+                if session.turn():
+                    still_active.append(session)
+                    continue
+            except Exception:
+                errors += 1
+            turns += session.turns
+            for state_name, durations in session.latencies.items():
+                latencies[state_name].extend(durations)
+        active = still_active
+    elapsed = time.perf_counter() - start
+    return {
+        "turns": turns,
+        "errors": errors,
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "prediction_cache": model.stats(),
+    }
+
+
+def memory_per_session(scripts, n_sessions=200):
+    """Memory in bytes that a live session takes, measured halfway its script."""
+    model = get_model()
+    # Load shared resources first, so they are not attributed to the sessions
+    get_restaurant_index()
+    Replay(scripts[0], model).advance()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = []
+    for idx in range(n_sessions):
+        script = scripts[idx % len(scripts)]
+        session = Replay(script, model)
+        if session.advance():
+            for _ in range(len(script) // 2):
+                if not session.turn():
+                    break
+        sessions.append(session)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / n_sessions
+
+
+def _run_worker(args):
+    """Entry point of a worker process."""
+    return run_sessions(*args)
+
+
+def load_test(scripts, n_sessions=1000, processes=None, concurrency=100):
+    """Replay sessions over a pool of processes, and combine their statistics."""
+    processes = processes or multiprocessing.cpu_count()
+    per_process = [
+        n_sessions // processes + (idx < n_sessions % processes)
+        for idx in range(processes)
+    ]
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(
+            _run_worker,
+            [(scripts, n, concurrency, seed) for seed, n in enumerate(per_process)],
+        )
+    elapsed = time.perf_counter() - start
+
+    latencies = defaultdict(list)
+    for result in results:
+        for state_name, durations in result["latencies"].items():
+            latencies[state_name].extend(durations)
+    turns = sum(result["turns"] for result in results)
+    cache_stats = {
+        name: sum(result["prediction_cache"][name] for result in results)
+        for name in ["requests", "hits", "shared_hits", "misses"]
+    }
+    cache_stats["hit_rate"] = (
+        (cache_stats["hits"] + cache_stats["shared_hits"]) / cache_stats["requests"]
+        if cache_stats["requests"]
+        else 0.0
+    )
+    return {
+        "sessions": n_sessions,
+        "processes": processes,
+        "turns": turns,
+        "errors": sum(result["errors"] for result in results),
+        "elapsed_s": elapsed,
+        "turns_per_s": turns / elapsed,
+        "latency_ms": {
+            state_name: {
+                "count": len(durations),
+                "p50": percentile(durations, 0.50) * 1000,
+                "p99": percentile(durations, 0.99) * 1000,
+            }
+            for state_name, durations in sorted(latencies.items())
+        },
+        "prediction_cache": cache_stats,
+        "memory_per_session_kb": memory_per_session(scripts) / 1024,
+    }
+
+
+def read_scripts(path):
+    """Read recorded dialogs, one JSON list of user turns per line."""
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument(
+        "--concurrency", type=int, default=100, help="live sessions per process"
+    )
+    parser.add_argument("--scripts", help="file with one JSON list of turns per line")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    scripts = read_scripts(args.scripts) if args.scripts else SCRIPTS
+    results = load_test(scripts, args.sessions, args.processes, args.concurrency)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(
+            f"{results['sessions']} sessions over {results['processes']} processes: "
+            f"{results['turns']} turns in {results['elapsed_s']:.2f}s, "
+            f"{results['turns_per_s']:.0f} turns/s, {results['errors']} errors"
+        )
+        print(f"Memory per session: {results['memory_per_session_kb']:.1f} KB")
+        cache_stats = results["prediction_cache"]
+        print(
+            f"Prediction cache: {cache_stats['hit_rate'] * 100:.1f}% hits, "
+            f"{cache_stats['misses']} of {cache_stats['requests']} sentences classified"
+        )
+        print("Latency per state (ms):")
+        for state_name, stats in results["latency_ms"].items():
+            print(
+                f"    {state_name:<28} n={stats['count']:<7} "
+                f"p50={stats['p50']:.3f} p99={stats['p99']:.3f}"
+            )
@@ -1,15 +1,22 @@
 """Module that implements different ML classifiers and some utility functions."""
+import functools
+import hashlib
+import itertools
 import os
 import pickle
 
-from sklearn.linear_model import LogisticRegression
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.feature_extraction.text import HashingVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.pipeline import Pipeline
 
+from extract import iter_chunks, iter_dialog_data
+from model_artifact import export_model, is_artifact, load_artifact
+from sparse_neighbors import SparseNeighborsClassifier
+
 
 # Models that are implemented
 MODELS = [
@@ -18,31 +25,170 @@ MODELS = [
     ("Random forest classifier", "random_forest.pickle", RandomForestClassifier),
     ("Descision tree classifier", "descision_tree.pickle", DecisionTreeClassifier),
     ("K-nearest neighbors classifier", "k_nearest.pickle", KNeighborsClassifier),
+    (
+        "Sparse nearest neighbors classifier",
+        "sparse_neighbors.pickle",
+        SparseNeighborsClassifier,
+    ),
+]
+
+# Logistic loss of SGDClassifier, which is called "log" before sklearn 1.1
+LOG_LOSS = "log_loss" if "log_loss" in SGDClassifier.loss_functions else "log"
+
+# Models that can be trained incrementally, one batch of data at a time
+ONLINE_MODELS = [
+    ("Online multinomial naive bayes", "online_multi_nb.pickle", MultinomialNB),
+    (
+        "Online logistic regression",
+        "online_log_reg.pickle",
+        functools.partial(SGDClassifier, loss=LOG_LOSS),
+    ),
 ]
 
+# Number of columns that online models hash words into
+N_HASHED_FEATURES = 2**16
+
 # Directory where pickle files are saved
 MODEL_DIR = "models/"
 
 
 def load_model(filename):
-    """Load model from pickle file in models directory."""
+    """Load model from pickle file or model artifact in models directory."""
+    path = os.path.join(MODEL_DIR, filename)
+    if is_artifact(path):
+        return load_artifact(path)
 
-    with open(os.path.join(MODEL_DIR, filename), "rb") as file:
+    with open(path, "rb") as file:
         return pickle.load(file)
 
 
-def train_model(train_x, train_y, classifier_model):
-    """Train a model."""
-    pipe = Pipeline(
-        [("vectorizer", CountVectorizer()), ("classifier", classifier_model())]
-    )
-    return pipe.fit(train_x, train_y)
+def train_model(features, classifier_model):
+    """Train a model on the vectorized training data of the feature cache."""
+    classifier = classifier_model().fit(features.x_train, features.y_train)
+    return Pipeline([("vectorizer", features.vectorizer()), ("classifier", classifier)])
 
 
 def save_model(model, filename):
-    """Save a model to pickle file in models directory."""
+    """
+    Save a model to pickle file in models directory.
+
+    If the model was exported to a model artifact, that is exported again too, so
+    the artifact does not keep predicting with the old model.
+    """
     with open(os.path.join(MODEL_DIR, filename), "wb") as f:
         pickle.dump(model, f)
+    artifact = artifact_filename(filename)
+    if is_artifact(os.path.join(MODEL_DIR, artifact)):
+        export_artifact(model, artifact)
+
+
+def chain_digest(digest, dialog_act, sentence):
+    """Digest of the sentences that a digest is of, followed by one more."""
+    return hashlib.sha256(f"{digest}\n{dialog_act} {sentence}".encode()).hexdigest()
+
+
+def skip_trained(pairs, n_sentences, digest):
+    """
+    Skip the first n_sentences pairs, returns whether their chained digest is digest.
+
+    So whether a file still starts with the sentences that a model was trained on.
+    """
+    prefix, n_read = "", 0
+    for dialog_act, sentence in itertools.islice(pairs, n_sentences):
+        prefix = chain_digest(prefix, dialog_act, sentence)
+        n_read += 1
+    return n_read == n_sentences and prefix == digest
+
+
+def train_online(
+    paths,
+    classes,
+    classifier_model,
+    filename,
+    batch_size=1000,
+    checkpoint_every=10,
+    resume=True,
+):
+    """
+    Train a model on the train split of data files in batches, with partial_fit.
+
+    Sentences are hashed by a stateless vectorizer, so the files do not have to fit
+    in memory. The model is saved to filename every checkpoint_every batches and at
+    the end. With resume, training continues from the saved model if there is one,
+    so new data can be added to it later.
+
+    The model keeps how many sentences of each file it was trained on, with a digest
+    of those sentences, in its checkpoints. Those sentences are skipped if the file
+    still starts with them, so files that are appended to are only trained on what
+    is new, and after a crash, training continues where the last checkpoint was
+    saved. Files that were replaced are trained on from the start. Raises a
+    ValueError if the files have labels that a resumed model was not trained with.
+    """
+    path = os.path.join(MODEL_DIR, filename)
+    if resume and os.path.exists(path):
+        model = load_model(filename)
+    else:
+        vectorizer = HashingVectorizer(
+            n_features=N_HASHED_FEATURES, alternate_sign=False, norm=None
+        )
+        model = Pipeline(
+            [("vectorizer", vectorizer), ("classifier", classifier_model())]
+        )
+    # Saved with the model, so progress and model are always checkpointed together
+    if not hasattr(model, "trained_files_"):
+        model.trained_files_ = {}
+
+    vectorizer = model.named_steps["vectorizer"]
+    classifier = model.named_steps["classifier"]
+    if hasattr(classifier, "classes_"):
+        # partial_fit can't learn labels after the first batch
+        new_labels = set(classes) - set(classifier.classes_)
+        if new_labels:
+            raise ValueError(
+                f"Labels {sorted(new_labels)} are not known to {filename}, it has to "
+                "be trained again from the start to learn them"
+            )
+        classes = classifier.classes_
+
+    n_batches = 0
+    for data_path in [paths] if isinstance(paths, str) else paths:
+        key = os.path.abspath(data_path)
+        n_sentences, digest = model.trained_files_.get(key, (0, ""))
+        pairs = iter_dialog_data(data_path, split="train")
+        if not skip_trained(pairs, n_sentences, digest):
+            n_sentences, digest = 0, ""
+            pairs = iter_dialog_data(data_path, split="train")
+        for sentences, labels in iter_chunks(pairs, batch_size):
+            classifier.partial_fit(
+                vectorizer.transform(sentences), labels, classes=classes
+            )
+            for label, sentence in zip(labels, sentences):
+                digest = chain_digest(digest, label, sentence)
+            n_sentences += len(sentences)
+            model.trained_files_[key] = (n_sentences, digest)
+            n_batches += 1
+            if n_batches % checkpoint_every == 0:
+                save_checkpoint(model, filename)
+    save_checkpoint(model, filename)
+    return model
+
+
+def save_checkpoint(model, filename):
+    """Save a model like save_model, but replace the old file only once written."""
+    path = os.path.join(MODEL_DIR, filename)
+    with open(f"{path}.tmp", "wb") as file:
+        pickle.dump(model, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def artifact_filename(filename):
+    """Filename of the model artifact that a pickled model is exported to."""
+    return f"{os.path.splitext(filename)[0]}.model"
+
+
+def export_artifact(model, filename):
+    """Export a linear model to a model artifact in models directory."""
+    export_model(model, os.path.join(MODEL_DIR, filename))
 
 
 def select_model():
@@ -57,3 +203,11 @@ def select_model():
         except ValueError:
             print(f"Please select a value in {list(range(1, len(MODELS) + 1))}")
     return MODELS[selected]
+
+
+if __name__ == "__main__":
+    # Export a selected pickled model to a fast loading model artifact
+    name, filename, _ = select_model()
+    artifact = artifact_filename(filename)
+    export_artifact(load_model(filename), artifact)
+    print(f"Exported {name} to {os.path.join(MODEL_DIR, artifact)}")
@@ -0,0 +1,209 @@
+"""
+Model artifacts that load without unpickling sklearn pipelines.
+
+A linear bag-of-words model is stored as a directory, with a small JSON header and
+its vocabulary, coefficients, intercepts and class labels as .npy arrays. The arrays
+are memory-mapped when loaded, so loading is near-instant, the pages are shared by
+all worker processes, and predicting does not need sklearn.
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+
+# Arrays that make up an artifact, each stored as <name>.npy
+ARRAYS = ["terms", "columns", "weights", "intercept", "classes"]
+
+# Vectorizer settings that a LinearModel can reproduce without sklearn
+SUPPORTED_VECTORIZER = {
+    "analyzer": "word",
+    "ngram_range": (1, 1),
+    "preprocessor": None,
+    "tokenizer": None,
+    "stop_words": None,
+    "strip_accents": None,
+}
+
+
+def is_artifact(path):
+    """Whether some path points to a model artifact, rather than a pickle file."""
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+def linear_parameters(classifier):
+    """Get the coefficients and intercepts of a fitted linear classifier."""
+    # Multinomial naive bayes is linear in log space
+    if hasattr(classifier, "feature_log_prob_"):
+        return classifier.feature_log_prob_, classifier.class_log_prior_
+    if hasattr(classifier, "coef_") and hasattr(classifier, "intercept_"):
+        return classifier.coef_, classifier.intercept_
+    raise ValueError(f"Can not export {type(classifier).__name__}, it is not linear")
+
+
+def linear_arrays(pipeline):
+    """
+    Get the header and arrays of a fitted vectorizer and linear classifier pipeline.
+
+    Raises ValueError if the vectorizer or classifier can not be reproduced.
+    """
+    vectorizer = pipeline.named_steps["vectorizer"]
+    classifier = pipeline.named_steps["classifier"]
+
+    params = vectorizer.get_params()
+    for param, supported in SUPPORTED_VECTORIZER.items():
+        if params[param] != supported:
+            raise ValueError(
+                f"Can not export a vectorizer with {param}={params[param]}"
+            )
+    coef, intercept = linear_parameters(classifier)
+
+    # Terms are sorted, so the same model always gives the same arrays
+    vocabulary = vectorizer.vocabulary_
+    terms = np.array(sorted(vocabulary))
+    arrays = {
+        "terms": terms,
+        "columns": np.array([vocabulary[term] for term in terms], dtype=np.int64),
+        # Stored per feature, so looking up the weights of a token is one row
+        "weights": np.ascontiguousarray(np.asarray(coef, dtype=np.float64).T),
+        "intercept": np.asarray(intercept, dtype=np.float64),
+        "classes": np.asarray(classifier.classes_).astype(str),
+    }
+    header = {
+        "format_version": FORMAT_VERSION,
+        "classifier": type(classifier).__name__,
+        "lowercase": params["lowercase"],
+        "token_pattern": params["token_pattern"],
+        "binary": params["binary"],
+        "n_features": len(terms),
+        "n_classes": len(arrays["classes"]),
+    }
+    return header, arrays
+
+
+def export_model(pipeline, path):
+    """Export a fitted vectorizer and linear classifier pipeline to an artifact."""
+    header, arrays = linear_arrays(pipeline)
+    os.makedirs(path, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(path, f"{name}.npy"), arrays[name], allow_pickle=False)
+    with open(os.path.join(path, HEADER_FILE), "w") as file:
+        json.dump(header, file, indent=4)
+
+
+def load_artifact(path, mmap=True):
+    """Load a model artifact from a directory."""
+    with open(os.path.join(path, HEADER_FILE)) as file:
+        header = json.load(file)
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact version {header['format_version']}")
+    arrays = {
+        name: np.load(
+            os.path.join(path, f"{name}.npy"),
+            mmap_mode="r" if mmap else None,
+            allow_pickle=False,
+        )
+        for name in ARRAYS
+    }
+    return LinearModel.from_arrays(header, arrays)
+
+
+class LinearModel:
+    """
+    A bag-of-words linear classifier, that predicts with NumPy only.
+
+    Mirrors the predictions of a CountVectorizer followed by a linear classifier.
+    Tokens are looked up in a dict, and the weights of the known tokens of each
+    sentence are summed, so predicting skips the input validation and sparse
+    matrices of a Pipeline.
+    """
+
+    def __init__(
+        self,
+        terms,
+        columns,
+        weights,
+        intercept,
+        classes,
+        lowercase=True,
+        token_pattern=r"(?u)\b\w\w+\b",
+        binary=False,
+        header=None,
+    ):
+        self.terms = terms
+        self.columns = columns
+        self.weights = weights
+        self.intercept = intercept
+        self.classes_ = classes
+        self.lowercase = lowercase
+        self.token_regex = re.compile(token_pattern)
+        self.binary = binary
+        self.header = header or {}
+        # Row of the weights of each term
+        self.vocabulary = dict(zip(terms.tolist(), columns.tolist()))
+
+    @classmethod
+    def from_arrays(cls, header, arrays):
+        """Create a model from the header and arrays of an artifact."""
+        return cls(
+            header=header,
+            lowercase=header["lowercase"],
+            token_pattern=header["token_pattern"],
+            binary=header["binary"],
+            **arrays,
+        )
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """Extract the model of a fitted vectorizer and linear classifier pipeline."""
+        return cls.from_arrays(*linear_arrays(pipeline))
+
+    def tokenize(self, sentence):
+        """Split a sentence into tokens, in the same way as CountVectorizer."""
+        if self.lowercase:
+            sentence = sentence.lower()
+        return self.token_regex.findall(sentence)
+
+    def lookup(self, sentence):
+        """Rows of the weights of the known tokens of a sentence."""
+        tokens = self.tokenize(sentence)
+        if self.binary:
+            tokens = dict.fromkeys(tokens)
+        vocabulary = self.vocabulary
+        return [vocabulary[token] for token in tokens if token in vocabulary]
+
+    def decision_function(self, sentences):
+        """Score every class for each sentence."""
+        sentences = list(sentences)
+        if len(sentences) == 1:
+            # A single sentence, as the dialog system classifies, needs no offsets
+            rows = self.lookup(sentences[0])
+            return (self.intercept + self.weights[rows].sum(axis=0))[np.newaxis]
+
+        rows, lengths = [], []
+        for sentence in sentences:
+            sentence_rows = self.lookup(sentence)
+            rows.extend(sentence_rows)
+            lengths.append(len(sentence_rows))
+        lengths = np.array(lengths, dtype=np.int64)
+        scores = np.tile(self.intercept, (len(sentences), 1))
+        if rows:
+            # Sum the weights of the tokens of each sentence that has any
+            starts = np.cumsum(lengths) - lengths
+            has_tokens = lengths > 0
+            scores[has_tokens] += np.add.reduceat(
+                self.weights[rows], starts[has_tokens], axis=0
+            )
+        return scores
+
+    def predict(self, sentences):
+        """Predict the class of each sentence."""
+        scores = self.decision_function(sentences)
+        if scores.shape[1] == 1:
+            # Binary models only have a score for the positive class
+            return self.classes_[(scores[:, 0] > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
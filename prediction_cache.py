@@ -0,0 +1,205 @@
+"""
+Cache of dialog act predictions, in front of the classifier.
+
+User turns repeat a lot ("yes", "thank you good bye"), so predictions are kept by
+normalized utterance. Each process keeps a bounded LRU cache, and can share a SQLite
+file with other processes, which is also bounded, and evicts the least recently used
+predictions. Entries are keyed by the version of the model, so retraining a model
+never returns predictions of the old one.
+"""
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Number of entries in the shared file, per entry that may be kept in a process
+SHARED_SIZE_FACTOR = 10
+
+
+def normalize(sentence):
+    """
+    Lowercase a sentence, and collapse its whitespace.
+
+    Vectorizers of the models lowercase and split on non-word characters, so
+    sentences with the same normalized form always get the same prediction.
+    """
+    return " ".join(sentence.lower().split())
+
+
+class PredictionCache:
+    """
+    A model whose predictions are cached by normalized utterance.
+
+    A drop-in for the model: predict classifies only sentences that are not cached,
+    in one call, and other attributes are those of the model. Given a path, misses
+    of the in-process cache are looked up in a SQLite file that processes share.
+    """
+
+    def __init__(self, model, version, max_size=4096, path=None, shared_size=None):
+        self.model = model
+        self.version = version
+        self.max_size = max_size
+        self.path = path
+        self.shared_size = shared_size or max_size * SHARED_SIZE_FACTOR
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Connections can not be shared by threads, nor used after a fork, so each
+        # thread of each process opens its own
+        self._local = threading.local()
+        self._inserts = 0
+        self.reset_stats()
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set on the cache, like classes_
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _connect(self):
+        """The connection to the shared file of this thread, opened on first use."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # Readers do not block the writer, and entries can be lost on a crash
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "version TEXT, utterance TEXT, label TEXT, used REAL, "
+                "PRIMARY KEY (version, utterance))"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used)"
+            )
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _transaction(connection):
+        """Run the statements in a with block as one transaction."""
+        connection.execute("BEGIN")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _shared_get(self, utterances):
+        """Look up utterances in the shared file, and mark them as used."""
+        connection = self._connect()
+        found = {}
+        for utterance in utterances:
+            row = connection.execute(
+                "SELECT label FROM predictions WHERE version = ? AND utterance = ?",
+                (self.version, utterance),
+            ).fetchone()
+            if row is not None:
+                found[utterance] = row[0]
+        if found:
+            with self._transaction(connection):
+                connection.executemany(
+                    "UPDATE predictions SET used = ? WHERE version = ? AND utterance = ?",
+                    [(time.time(), self.version, utterance) for utterance in found],
+                )
+        return found
+
+    def _shared_put(self, labels):
+        """Store predictions in the shared file, evicting the oldest when it is full."""
+        connection = self._connect()
+        now = time.time()
+        with self._transaction(connection):
+            connection.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                [
+                    (self.version, utterance, label, now)
+                    for utterance, label in labels.items()
+                ],
+            )
+
+        # Counting rows takes a scan, so the size is only checked now and then
+        with self._lock:
+            self._inserts += len(labels)
+            prune = self._inserts >= max(self.shared_size // 10, 1)
+            if prune:
+                self._inserts = 0
+        if prune:
+            connection.execute(
+                "DELETE FROM predictions WHERE rowid IN ("
+                "SELECT rowid FROM predictions ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.shared_size,),
+            )
+
+    def predict(self, sentences):
+        """Predict the class of each sentence, classifying only uncached sentences."""
+        utterances = [normalize(sentence) for sentence in sentences]
+        labels = {}
+        with self._lock:
+            for utterance in utterances:
+                if utterance in self._entries:
+                    self._entries.move_to_end(utterance)
+                    labels[utterance] = self._entries[utterance]
+            self.hits += sum(utterance in labels for utterance in utterances)
+
+        missing = list(dict.fromkeys(u for u in utterances if u not in labels))
+        new_labels = {}
+        shared_hits, misses = 0, 0
+        if missing and self.path is not None:
+            try:
+                new_labels = self._shared_get(missing)
+            except sqlite3.Error:
+                # The shared file is only a cache, so fall back on classifying
+                new_labels = {}
+            shared_hits = sum(utterance in new_labels for utterance in utterances)
+            missing = [u for u in missing if u not in new_labels]
+
+        if missing:
+            predicted = dict(zip(missing, self.model.predict(missing).tolist()))
+            misses = sum(utterance in predicted for utterance in utterances)
+            if self.path is not None:
+                try:
+                    self._shared_put(predicted)
+                except sqlite3.Error:
+                    pass
+            new_labels.update(predicted)
+
+        with self._lock:
+            # Counted under the lock, as threads of a service share the cache
+            self.shared_hits += shared_hits
+            self.misses += misses
+            for utterance, label in new_labels.items():
+                self._entries[utterance] = label
+                self._entries.move_to_end(utterance)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        labels.update(new_labels)
+        return np.array([labels[utterance] for utterance in utterances])
+
+    def stats(self):
+        """Hits, misses and hit rate of the predictions since the last reset."""
+        with self._lock:
+            hits, shared_hits, misses = self.hits, self.shared_hits, self.misses
+            size = len(self._entries)
+        requests = hits + shared_hits + misses
+        return {
+            "requests": requests,
+            "hits": hits,
+            "shared_hits": shared_hits,
+            "misses": misses,
+            "hit_rate": (hits + shared_hits) / requests if requests else 0.0,
+            "size": size,
+        }
+
+    def reset_stats(self):
+        """Forget the hits and misses so far."""
+        with self._lock:
+            self.hits = 0
+            self.shared_hits = 0
+            self.misses = 0
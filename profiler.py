@@ -0,0 +1,198 @@
+"""
+Sampling profiler, that attributes time and allocations to states and stages.
+
+Run a script under the profiler with python profiler.py [options] script.py [args].
+A background thread samples the stack of the main thread at a set interval. Each
+sample is attributed to the StateInterface subclass whose steps are running, and to
+the stages that scripts mark with stage(). The CPU time of the thread between samples
+is attributed the same way, and with --memory, so is the memory that is allocated.
+The samples are written as collapsed stacks, one "frame;frame;frame count" line per
+stack, which flamegraph.pl, speedscope and https://www.speedscope.app read.
+Work in worker processes is not sampled, only the waiting for it.
+"""
+import argparse
+import contextlib
+import os
+import runpy
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+# Stages that are marked in each thread, outermost first
+_stages = defaultdict(list)
+
+# Files of the frames that run a script under the profiler
+RUNNER_FILES = {__file__, runpy.__file__, "<frozen runpy>"}
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Mark the code in a with block as a stage, for the profiler to attribute to."""
+    stages = _stages[threading.get_ident()]
+    stages.append(name)
+    try:
+        yield
+    finally:
+        stages.pop()
+
+
+def frame_name(frame):
+    """Name of a frame in a collapsed stack, its file and function."""
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def state_of(frame):
+    """Name of the state whose steps run in a frame, or None."""
+    if frame.f_code.co_name != "steps":
+        return None
+    state = frame.f_locals.get("self")
+    # Compared by name, so states of dialog_system run as __main__ also count
+    if any(cls.__name__ == "StateInterface" for cls in type(state).__mro__[1:]):
+        return type(state).__name__
+    return None
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of a thread in a background thread.
+
+    Keeps the number of samples of each collapsed stack, and the samples, CPU time
+    and allocated bytes of each state or stage.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005, memory=False):
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.interval = interval
+        self.memory = memory
+        self.stacks = Counter()
+        self.samples = Counter()
+        self.wall_time = defaultdict(float)
+        self.cpu_time = defaultdict(float)
+        self.allocated = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = None
+        try:
+            self._clock = time.pthread_getcpuclockid(self.thread_id)
+        except (AttributeError, OSError):
+            # Without a clock per thread, the interval estimates the CPU time
+            self._clock = None
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if self.memory:
+            tracemalloc.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _cpu_clock(self):
+        if self._clock is None:
+            return time.perf_counter()
+        try:
+            return time.clock_gettime(self._clock)
+        except OSError:
+            # The thread has finished
+            return 0.0
+
+    def _sample(self):
+        """The collapsed stack of the thread, with its label as the root frames."""
+        frame = sys._current_frames().get(self.thread_id)
+        names, state = [], None
+        while frame is not None:
+            # Frames of the profiler that runs a script are left out
+            if frame.f_code.co_filename not in RUNNER_FILES:
+                names.append(frame_name(frame))
+            state = state or state_of(frame)
+            frame = frame.f_back
+        label = [f"stage:{name}" for name in _stages.get(self.thread_id, [])]
+        if state is not None:
+            label.append(f"state:{state}")
+        return tuple(label or ["other"]), tuple(reversed(names))
+
+    def _run(self):
+        last_wall = time.perf_counter()
+        last_cpu = self._cpu_clock()
+        last_memory = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        while not self._stop.wait(self.interval):
+            label, names = self._sample()
+            key = ";".join(label)
+            self.stacks[label + names] += 1
+            self.samples[key] += 1
+
+            # Samples can be further apart than the interval, so time is measured
+            wall, cpu = time.perf_counter(), self._cpu_clock()
+            self.wall_time[key] += wall - last_wall
+            self.cpu_time[key] += cpu - last_cpu
+            last_wall, last_cpu = wall, cpu
+            if self.memory:
+                memory = tracemalloc.get_traced_memory()[0]
+                # Only growth is counted, memory that is freed is not
+                self.allocated[key] += max(memory - last_memory, 0)
+                last_memory = memory
+
+    def write_collapsed(self, path):
+        """Write the sampled stacks in the collapsed format of flamegraph.pl."""
+        with open(path, "w") as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f"{';'.join(stack)} {count}\n")
+
+    def summary(self):
+        """Table of the samples, CPU time and allocations of each state or stage."""
+        from prettytable import PrettyTable
+
+        columns = ["State or stage", "Samples", "Wall time", "CPU time"]
+        table = PrettyTable(columns + (["Allocated"] if self.memory else []))
+        for key, count in self.samples.most_common():
+            row = [
+                key,
+                count,
+                f"{self.wall_time[key]:.3f}s",
+                f"{self.cpu_time[key]:.3f}s",
+            ]
+            if self.memory:
+                row.append(f"{self.allocated[key] / 2**20:.1f} MB")
+            table.add_row(row)
+        table.align["State or stage"] = "l"
+        return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--interval", type=float, default=0.005, help="in seconds")
+    parser.add_argument("--output", default="profile.collapsed")
+    parser.add_argument(
+        "--memory", action="store_true", help="attribute allocations, with tracemalloc"
+    )
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    # Run the script like python would, with its own arguments and directory
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    # Stages are marked through the imported module, rather than this __main__ one
+    import profiler as imported
+
+    profiler = imported.SamplingProfiler(interval=args.interval, memory=args.memory)
+    try:
+        with profiler:
+            runpy.run_path(args.script, run_name="__main__")
+    finally:
+        profiler.write_collapsed(args.output)
+        print(profiler.summary().get_string(), file=sys.stderr)
+        print(f"Saved collapsed stacks to {args.output}.", file=sys.stderr)
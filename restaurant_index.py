@@ -0,0 +1,62 @@
+"""Bitmap index over the restaurant data, to answer slot queries without copying."""
+import numpy as np
+
+# Columns of the restaurant data that users can state a preference for
+INDEXED_COLUMNS = [
+    "pricerange",
+    "area",
+    "food",
+    "food quality",
+    "crowdedness",
+    "length of stay",
+]
+
+# Values that mean that the user has no preference
+SKIP = {"all", "any"}
+
+
+class RestaurantIndex:
+    """
+    Index with a precomputed bitmap for each (column, value) pair in the data.
+
+    Bitmaps are boolean arrays over the rows of the data, packed into bits. A query
+    for some (column, value) pairs is a bitwise and of their bitmaps, and gives the
+    row ids of the restaurants that match, rather than a copy of the data.
+    """
+
+    def __init__(self, data, columns=INDEXED_COLUMNS):
+        self.n_rows = len(data)
+        self.bitmaps = {}
+        for column in columns:
+            # Codes are -1 for missing values, so those never match a query
+            codes, values = data[column].factorize()
+            for code, value in enumerate(values):
+                self.bitmaps[(column, value)] = np.packbits(codes == code)
+
+        self.all_rows = np.packbits(np.ones(self.n_rows, dtype=bool))
+        self.no_rows = np.zeros_like(self.all_rows)
+
+    def bitmap(self, column, value):
+        """Get the bitmap of the rows where column has value."""
+        if value in SKIP:
+            return self.all_rows
+        return self.bitmaps.get((column, value), self.no_rows)
+
+    def mask(self, bitmap):
+        """Unpack a bitmap into a boolean array with one element per row."""
+        return np.unpackbits(bitmap, count=self.n_rows).astype(bool)
+
+    def row_ids(self, bitmap):
+        """Get the ids of the rows that are set in a bitmap."""
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.n_rows))
+
+    def query(self, conditions):
+        """Get the bitmap of the rows that match all (column, value) conditions."""
+        result = self.all_rows
+        for column, value in conditions:
+            result = result & self.bitmap(column, value)
+        return result
+
+    def select(self, conditions):
+        """Get the row ids of the rows that match all (column, value) conditions."""
+        return self.row_ids(self.query(conditions))
@@ -0,0 +1,160 @@
+"""
+Nearest neighbors classifier for sparse bag-of-words vectors.
+
+Most training sentences share no words with a sentence to classify. Their distance
+to it only depends on their own norm, so they are ranked by a precomputed order, and
+only sentences that share words with it are compared, with a sparse matrix product
+that goes through the postings of its words, like an inverted index does. The
+neighbors are exact, ties in distance go to the sentence that comes first in the
+training data.
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+METRICS = {"euclidean", "cosine"}
+
+
+class SparseNeighborsClassifier(ClassifierMixin, BaseEstimator):
+    """
+    K-nearest neighbors classifier, with euclidean or cosine distance.
+
+    Neighbors vote with equal weight, ties between classes go to the first class.
+    """
+
+    def __init__(self, n_neighbors=5, metric="euclidean"):
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+
+    def _rows(self, X):
+        """Rows as a CSR matrix of floats, normalized for the cosine distance."""
+        X = csr_matrix(X, dtype=np.float64)
+        if self.metric == "cosine":
+            norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            X = csr_matrix(X.multiply(1 / norms[:, np.newaxis]))
+        return X
+
+    def fit(self, X, y):
+        """
+        Store the distinct training rows, their norms and the labels of all rows.
+
+        Sentences repeat a lot, and equal rows are at the same distance from any
+        query, so distances are only computed once for each distinct row.
+        """
+        if self.metric not in METRICS:
+            raise ValueError(f"Unknown metric {self.metric}, pick from {METRICS}")
+        # A copy, as cached features are read-only and equal rows are found by
+        # sorting their indices
+        X = self._rows(X).copy()
+        X.sum_duplicates()
+        self.classes_, self.labels_ = np.unique(np.asarray(y), return_inverse=True)
+        self.n_features_in_ = X.shape[1]
+
+        # Number the distinct rows in the order that they first occur
+        distinct = {}
+        row_ids = np.array(
+            [
+                distinct.setdefault(
+                    (
+                        X.indices[start:end].tobytes(),
+                        X.data[start:end].tobytes(),
+                    ),
+                    len(distinct),
+                )
+                for start, end in zip(X.indptr[:-1], X.indptr[1:])
+            ],
+            dtype=np.int64,
+        )
+        # Positions of the copies of each distinct row, in increasing order
+        self.copies_ = np.argsort(row_ids, kind="stable")
+        counts = np.bincount(row_ids)
+        self.copies_start_ = np.concatenate([[0], np.cumsum(counts)])
+        rows = X[self.copies_[self.copies_start_[:-1]]]
+
+        # Columns of the transpose are the postings of each word
+        self.postings_ = rows.T.tocsr()
+        self.counts_ = counts
+        self.squared_norms_ = np.asarray(rows.multiply(rows).sum(axis=1)).ravel()
+        # Distinct rows by increasing distance to queries they share no words with,
+        # and by first position for equal distances
+        if self.metric == "cosine":
+            self.by_norm_ = np.arange(rows.shape[0])
+        else:
+            self.by_norm_ = np.argsort(self.squared_norms_, kind="stable")
+        return self
+
+    def _positions(self, row_ids):
+        """Positions of all copies of some distinct rows."""
+        return np.concatenate(
+            [
+                self.copies_[self.copies_start_[row] : self.copies_start_[row + 1]]
+                for row in row_ids
+            ]
+        )
+
+    def kneighbors(self, X, n_neighbors=None):
+        """
+        Distances to, and positions of, the nearest training rows of each row.
+
+        Returns two arrays with a row of n_neighbors for each row of X, like
+        KNeighborsClassifier.kneighbors.
+        """
+        k = n_neighbors or self.n_neighbors
+        X = self._rows(X)
+        query_norms = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+        products = (X @ self.postings_).tocsr()
+        distances = np.empty((X.shape[0], k))
+        indices = np.empty((X.shape[0], k), dtype=np.int64)
+        # Marks the distinct rows that share words with the current query
+        shares_words = np.zeros(len(self.by_norm_), dtype=bool)
+        for row in range(X.shape[0]):
+            start, end = products.indptr[row], products.indptr[row + 1]
+            candidates = products.indices[start:end]
+            dots = products.data[start:end]
+
+            # The closest rows without shared words come first in by_norm_, as their
+            # distance only depends on their norm
+            shares_words[candidates] = True
+            others = self.by_norm_[: k + len(candidates)]
+            others = others[~shares_words[others]][:k]
+            shares_words[candidates] = False
+            if self.metric == "cosine":
+                # Rows without shared words are orthogonal to the query
+                candidate_distances = 1 - dots
+                other_distances = np.ones(len(others))
+            else:
+                candidate_distances = (
+                    query_norms[row] + self.squared_norms_[candidates] - 2 * dots
+                )
+                other_distances = query_norms[row] + self.squared_norms_[others]
+            row_ids = np.concatenate([candidates, others])
+            row_distances = np.concatenate([candidate_distances, other_distances])
+
+            # Only distinct rows up to the distance of the k-th copy can be
+            # neighbors, their copies are then ordered by distance and position
+            order = np.argsort(row_distances, kind="stable")
+            n_copies = np.cumsum(self.counts_[row_ids[order]])
+            kth = row_distances[
+                order[min(np.searchsorted(n_copies, k), len(order) - 1)]
+            ]
+            closest = row_ids[row_distances <= kth]
+            positions = self._positions(closest)
+            position_distances = np.repeat(
+                row_distances[row_distances <= kth], self.counts_[closest]
+            )
+            order = np.lexsort((positions, position_distances))[:k]
+            indices[row] = positions[order]
+            distances[row] = position_distances[order]
+
+        if self.metric == "euclidean":
+            distances = np.sqrt(np.maximum(distances, 0))
+        return distances, indices
+
+    def predict(self, X):
+        """Predict the class of each row, by a vote of its nearest neighbors."""
+        _, indices = self.kneighbors(X)
+        votes = np.zeros((indices.shape[0], len(self.classes_)), dtype=np.int64)
+        rows = np.repeat(np.arange(indices.shape[0]), indices.shape[1])
+        np.add.at(votes, (rows, self.labels_[indices].ravel()), 1)
+        return self.classes_[votes.argmax(axis=1)]
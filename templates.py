@@ -1,137 +1,192 @@
 """Templates to extract information from user inputs."""
 
+import functools
 import re
-from Levenshtein import distance
 
-
-def match_by_keywords(sentence, keywords, use_levenshtein=False):
-    """Match keywords in a sentence."""
+import tracing
+from fuzzy_index import FuzzyIndex
+from keyword_automaton import KeywordAutomaton
+
+KNOWN_RANGES = {"cheap", "expensive", "moderate"}
+KNOWN_AREAS = {"west", "north", "south", "centre", "east"}
+KNOWN_FOODS = {
+    "british",
+    "modern european",
+    "italian",
+    "romanian",
+    "seafood",
+    "chinese",
+    "steakhouse",
+    "asian oriental",
+    "french",
+    "portuguese",
+    "indian",
+    "spanish",
+    "european",
+    "vietnamese",
+    "korean",
+    "thai",
+    "moroccan",
+    "swiss",
+    "fusion",
+    "gastropub",
+    "tuscan",
+    "international",
+    "traditional",
+    "mediterranean",
+    "polynesian",
+    "african",
+    "turkish",
+    "bistro",
+    "north american",
+    "australasian",
+    "persian",
+    "jamaican",
+    "lebanese",
+    "cuban",
+    "japanese",
+    "catalan",
+}
+# Keywords of requests, which are named like the attributes of Information
+REQUEST_FIELDS = ["pricerange", "food", "area", "address", "postcode", "phone"]
+CONSEQUENTS = ["touristic", "assigned seats", "children", "romantic"]
+NEGATIONS = ["not", "no"]
+
+# Automata of the vocabularies, which are built once when this module is imported
+RANGE_AUTOMATON = KeywordAutomaton(KNOWN_RANGES)
+AREA_AUTOMATON = KeywordAutomaton(KNOWN_AREAS)
+FOOD_AUTOMATON = KeywordAutomaton(KNOWN_FOODS)
+REQUEST_AUTOMATON = KeywordAutomaton(REQUEST_FIELDS)
+CONSEQUENT_AUTOMATON = KeywordAutomaton(CONSEQUENTS)
+NEGATION_AUTOMATON = KeywordAutomaton(NEGATIONS)
+
+
+@functools.lru_cache(maxsize=None)
+def keyword_automaton(keywords):
+    """Get the automaton of a frozenset of keywords, which is built only once."""
+    return KeywordAutomaton(keywords)
+
+
+@functools.lru_cache(maxsize=None)
+def fuzzy_index(automaton):
+    """Get the fuzzy index of the keywords of an automaton, which is built only once."""
+    return FuzzyIndex(automaton.keywords)
+
+
+def confirmation_prompt(word, correction):
+    """Prompt that asks the user whether they meant correction when typing word."""
+    return f"Didn't recognize {word}, did you mean {correction}? (yes/no) \n"
+
+
+def ask_confirmation(word, correction):
+    """Ask the user in the terminal whether they meant correction when typing word."""
+    return input(confirmation_prompt(word, correction)) == "yes"
+
+
+def match_by_keywords(
+    sentence, keywords, use_levenshtein=False, confirm=ask_confirmation
+):
+    """
+    Match keywords in a sentence, the leftmost and longest keyword if there are more.
+
+    Keywords is a collection of keywords, or a KeywordAutomaton built from them.
+    """
     # TODO: Match don't care, any, whatever no preference, then return "ANY".
     sentence = sentence.lower().strip()
-    keyword_regex = rf"\b({'|'.join(keywords)})\b"
-    result = re.search(keyword_regex, sentence)
+    if not isinstance(keywords, KeywordAutomaton):
+        keywords = keyword_automaton(frozenset(keywords))
+    result = keywords.find(sentence)
     if result:
-        return result.group(1)
+        return result
     if use_levenshtein:
         for word in sentence.split():
             corrections = is_close_to_any(word, keywords)
             for correction in corrections:
-                response = input(
-                    f"Didn't recognize {word}, did you mean {correction}? (yes/no) \n"
-                )
-                if response == "yes":
+                if confirm(word, correction):
                     return correction
 
 
 def match_request(sentence, information):
     """Match which request a user has typed in a sentence."""
     information.reset_requests()
-    if match_by_keywords(sentence, ["pricerange"]):
-        information.pricerange_requested = True
-    if match_by_keywords(sentence, ["food"]):
-        information.food_requested = True
-    if match_by_keywords(sentence, ["area"]):
-        information.area_requested = True
-    if match_by_keywords(sentence, ["address"]):
-        information.address_requested = True
-    if match_by_keywords(sentence, ["postcode"]):
-        information.postcode_requested = True
-    if match_by_keywords(sentence, ["phone"]):
-        information.phone_requested = True
+    with tracing.span("match_request", words=len(sentence.split())) as attributes:
+        matches = REQUEST_AUTOMATON.find_all(sentence.lower().strip())
+        for _, field in matches:
+            setattr(information, f"{field}_requested", True)
+        attributes["requests"] = len(matches)
     return information
 
 
-def match_pricerange(sentence, use_levenshtein_keywords=True):
+def match_pricerange(sentence, use_levenshtein_keywords=True, confirm=ask_confirmation):
     """Matches the template for pricerange against a user input."""
     sentence = sentence.lower().strip()
     PATTERN = r"\b(\w+)\s(priced|pricing|price|pricerange)\b"
-    KNOWN_RANGES = {"cheap", "expensive", "moderate"}
-    match = match_template(sentence, PATTERN, KNOWN_RANGES, group=1)
+    match = match_template(sentence, PATTERN, RANGE_AUTOMATON, group=1, confirm=confirm)
     if not match:
         return match_by_keywords(
-            sentence, KNOWN_RANGES, use_levenshtein=use_levenshtein_keywords
+            sentence,
+            RANGE_AUTOMATON,
+            use_levenshtein=use_levenshtein_keywords,
+            confirm=confirm,
         )
     return match
 
 
-def match_area(sentence, use_levenshtein_keywords=True):
+def match_area(sentence, use_levenshtein_keywords=True, confirm=ask_confirmation):
     """Matches the template for area against a user input."""
     sentence = sentence.lower().strip()
-    KNOWN_AREAS = {"west", "north", "south", "centre", "east"}
     FIRST_PATT = r"\b(\w+)\spart\b"
     SECOND_PATT = r"(in the|somewhere)\s(\w+)"
-    first_match = match_template(sentence, FIRST_PATT, KNOWN_AREAS, group=1)
+    first_match = match_template(
+        sentence, FIRST_PATT, AREA_AUTOMATON, group=1, confirm=confirm
+    )
     if not first_match:
-        second_match = match_template(sentence, SECOND_PATT, KNOWN_AREAS, group=2)
+        second_match = match_template(
+            sentence, SECOND_PATT, AREA_AUTOMATON, group=2, confirm=confirm
+        )
         if not second_match:
             return match_by_keywords(
-                sentence, KNOWN_AREAS, use_levenshtein=use_levenshtein_keywords
+                sentence,
+                AREA_AUTOMATON,
+                use_levenshtein=use_levenshtein_keywords,
+                confirm=confirm,
             )
         return second_match
     return first_match
 
 
-def match_food(sentence, use_levenshtein_keywords=True):
+def match_food(sentence, use_levenshtein_keywords=True, confirm=ask_confirmation):
     """Matches the template for food against a user input."""
     sentence = sentence.lower().strip()
-    KNOWN_FOODS = {
-        "british",
-        "modern european",
-        "italian",
-        "romanian",
-        "seafood",
-        "chinese",
-        "steakhouse",
-        "asian oriental",
-        "french",
-        "portuguese",
-        "indian",
-        "spanish",
-        "european",
-        "vietnamese",
-        "korean",
-        "thai",
-        "moroccan",
-        "swiss",
-        "fusion",
-        "gastropub",
-        "tuscan",
-        "international",
-        "traditional",
-        "mediterranean",
-        "polynesian",
-        "african",
-        "turkish",
-        "bistro",
-        "north american",
-        "australasian",
-        "persian",
-        "jamaican",
-        "lebanese",
-        "cuban",
-        "japanese",
-        "catalan",
-    }
-
-    PATTERN = r"\b(\w+)\sfood|cuisine|kitchen|restaurant|place\b"
-    match = match_template(sentence, PATTERN, KNOWN_FOODS, group=1)
+    # Group 1 is the word before any of the nouns, a sentence without one falls
+    # back on matching keywords rather than failing on a missing group
+    PATTERN = r"\b(\w+)\s(?:food|cuisine|kitchen|restaurant|place)\b"
+    match = match_template(sentence, PATTERN, FOOD_AUTOMATON, group=1, confirm=confirm)
     if not match:
         return match_by_keywords(
-            sentence, KNOWN_FOODS, use_levenshtein=use_levenshtein_keywords
+            sentence,
+            FOOD_AUTOMATON,
+            use_levenshtein=use_levenshtein_keywords,
+            confirm=confirm,
         )
     return match
 
 
 def is_close_to_any(word, known_words, minimum_dist=3):
-    """From a list of words, find those words who are close to some known words."""
+    """
+    Find the known words that are close to a word, the closest ones first.
+
+    Known words is a collection of words, or a KeywordAutomaton built from them.
+    """
+    if not isinstance(known_words, KeywordAutomaton):
+        known_words = keyword_automaton(frozenset(known_words))
     return [
         known_word
-        for known_word in known_words
-        if distance(word, known_word) <= minimum_dist
+        for _, known_word in fuzzy_index(known_words).search(word, minimum_dist)
     ]
 
 
-def match_template(sentence, pattern, known_words, group=0):
+def match_template(sentence, pattern, known_words, group=0, confirm=ask_confirmation):
     """Match a pattern and known words against a user input."""
     match = re.search(pattern, sentence)
     if match:
@@ -143,16 +198,11 @@ def match_template(sentence, pattern, known_words, group=0):
 
         corrections = is_close_to_any(matched_word, known_words)
         for correction in corrections:
-            response = input(
-                f"Didn't recognize {matched_word}, did you mean {correction}? (yes/no) \n"
-            )
-            if response == "yes":
+            if confirm(matched_word, correction):
                 return correction
 
 
 def match_consequent(sentence):
     """Match which consequent a user inputs."""
-    KEYWORDS = ["touristic", "assigned seats", "children", "romantic"]
-    NEGATIVE_KEYWORDS = ["not", "no"]
-    match = match_by_keywords(sentence, KEYWORDS)
-    return match, match_by_keywords(sentence, NEGATIVE_KEYWORDS) is None
+    match = match_by_keywords(sentence, CONSEQUENT_AUTOMATON)
+    return match, match_by_keywords(sentence, NEGATION_AUTOMATON) is None
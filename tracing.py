@@ -0,0 +1,223 @@
+"""
+Tracing of the steps of the dialog system, to see where the time of a turn goes.
+
+A Tracer times spans, like running the steps of a state or classifying a sentence,
+and calls its hooks when each span starts and finishes. Hooks record the spans, for
+example as JSON lines or as Chrome trace events, which can be opened in
+chrome://tracing or https://ui.perfetto.dev. Code that runs within the steps of a
+traced dialog adds its own spans with span(), which does nothing when no tracer is
+active.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# The tracer of the dialog whose steps are running, if it is traced
+_current_tracer = contextvars.ContextVar("tracer", default=None)
+
+
+class Span:
+    """A named period of time, with attributes like the sizes of what it handled."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+        self.duration = None
+
+    def to_dict(self):
+        """The span as a dict, that can be written as JSON."""
+        return {
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class Hook:
+    """Base class of hooks, that are called around every span of a tracer."""
+
+    def start(self, span):
+        """Called when a span starts."""
+
+    def finish(self, span):
+        """Called when a span finishes, with its duration and attributes set."""
+
+
+class Tracer:
+    """Times spans, and calls its hooks around each of them."""
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Time the code in a with block as a span.
+
+        Yields the attributes of the span, so the block can add to them.
+        """
+        span = Span(name, attributes)
+        for hook in self.hooks:
+            hook.start(span)
+        span.start = time.perf_counter()
+        try:
+            yield span.attributes
+        finally:
+            span.duration = time.perf_counter() - span.start
+            for hook in self.hooks:
+                hook.finish(span)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Make this the tracer that span() records to, within a with block."""
+        token = _current_tracer.set(self)
+        try:
+            yield self
+        finally:
+            _current_tracer.reset(token)
+
+    def steps(self, name, steps, **attributes):
+        """
+        Steps that run other steps as a span, with this tracer active.
+
+        Only the time that the steps run counts, and not the time that they wait
+        for a reply. The tracer is active only while they run, so dialogs that take
+        turns in one thread each record to their own tracer.
+        """
+        with self.span(name, **attributes) as attributes:
+            wall_start = time.perf_counter()
+            busy, n_yields = 0.0, 0
+            reply = None
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        with self.activate():
+                            message = steps.send(reply)
+                    except StopIteration as stop:
+                        return stop.value
+                    finally:
+                        busy += time.perf_counter() - start
+                    n_yields += 1
+                    try:
+                        reply = yield message
+                    except GeneratorExit:
+                        steps.close()
+                        raise
+            finally:
+                attributes["yields"] = n_yields
+                attributes["wall_s"] = time.perf_counter() - wall_start
+                attributes["busy_s"] = busy
+
+
+def current_tracer():
+    """The active tracer, or None if nothing is traced."""
+    return _current_tracer.get()
+
+
+class _Untraced:
+    """Context of a span when nothing is traced, which only hands out attributes."""
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def __enter__(self):
+        return self.attributes
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def span(name, tracer=None, **attributes):
+    """
+    Time the code in a with block as a span of a tracer, by default the active one.
+
+    The with block gets the attributes of the span, so it can add sizes to them.
+    """
+    tracer = tracer or _current_tracer.get()
+    if tracer is None:
+        # A plain class, as this runs on every step even when nothing is traced
+        return _Untraced(attributes)
+    return tracer.span(name, **attributes)
+
+
+def traced_steps(tracer, name, steps, **attributes):
+    """Steps that run as a span of tracer, or just the steps if tracer is None."""
+    if tracer is None:
+        return steps
+    return tracer.steps(name, steps, **attributes)
+
+
+class JsonLinesHook(Hook):
+    """Writes each finished span to a file, as one line of JSON."""
+
+    def __init__(self, file):
+        self.file = file
+        self._lock = threading.Lock()
+
+    def finish(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self.file.write(line + "\n")
+
+
+class ChromeTraceHook(Hook):
+    """
+    Collects finished spans as complete events of the Chrome trace event format.
+
+    Events of each thread are shown on their own row, nested by time.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def finish(self, span):
+        self.events.append(
+            {
+                "name": span.name,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": span.attributes,
+            }
+        )
+
+    def save(self, path):
+        """Write the collected events to a JSON file."""
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.events}, file, default=str)
+
+
+class SummaryHook(Hook):
+    """
+    Keeps the count and total duration of the spans of each name.
+
+    Spans of steps count the time that they ran, without waiting for replies.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.totals = defaultdict(float)
+
+    def finish(self, span):
+        self.counts[span.name] += 1
+        self.totals[span.name] += span.attributes.get("busy_s", span.duration)
+
+    def summary(self):
+        """Count, total and mean duration in seconds of the spans of each name."""
+        return {
+            name: {
+                "count": count,
+                "total_s": self.totals[name],
+                "mean_s": self.totals[name] / count,
+            }
+            for name, count in self.counts.items()
+        }
@@ -1,15 +1,209 @@
-"""Script that trains a selected machine learning model."""
-import pickle
+"""
+Script that trains a selected machine learning model.
+
+Pass --all to train every model at once, in parallel over a pool of processes.
+Models are trained on the vectorized training data of the feature cache.
+Pass --online to train the online models on batches that are streamed from some
+data files, continuing from their saved models. The sentences at the start of
+files that the saved models were trained on are skipped, so only new data is added.
+"""
+import argparse
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sklearn.pipeline import Pipeline
+
+from extract import DIALOG_ACTS_FILE, iter_dialog_chunks, iter_dialog_data
+from feature_cache import get_features
+from machine_learning import (
+    MODEL_DIR,
+    MODELS,
+    ONLINE_MODELS,
+    select_model,
+    save_model,
+    train_model,
+    train_online,
+)
+from profiler import stage
+
+# Training data of a worker process, set once when the process starts
+_features = None
+_labels = None
+# Number of classifiers that a worker process has fit
+_n_fits = 0
+
+
+def _init_worker(features, labels):
+    """Keep the vectorized training data in a worker, so tasks don't resend it."""
+    global _features, _labels
+    _features, _labels = features, labels
+
+
+def _reset_peak_memory():
+    """Reset the peak resident memory of this process, returns whether Linux could."""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_memory():
+    """Peak resident memory of this process in bytes, or None if it is unknown."""
+    try:
+        # Linux keeps the peak that _reset_peak_memory resets, in kilobytes
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports it in kilobytes, macOS in bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _fit_classifier(classifier_model):
+    """
+    Fit a classifier in a worker, returns it with its fit time and peak memory.
 
+    Peak memory is the peak resident memory of the worker process during the fit.
+    Workers are reused, so it is None if the peak of an earlier fit can not be
+    reset.
+    """
+    global _n_fits
+    reset = _reset_peak_memory()
+    start = time.perf_counter()
+    classifier = classifier_model().fit(_features, _labels)
+    elapsed = time.perf_counter() - start
+    memory = _peak_memory() if reset or _n_fits == 0 else None
+    _n_fits += 1
+    return classifier, elapsed, memory
 
-from extract import create_dialog_dataset
-from machine_learning import select_model, train_model, save_model
+
+def train_all_models(features, models=MODELS, processes=None):
+    """
+    Train all models on the vectorized training data, and save them.
+
+    The classifiers are fit in parallel, and put in a pipeline after the shared
+    vectorizer, like train_model does. Returns a (name, filename, fit seconds, peak
+    memory in bytes or None, size in bytes) row for each model.
+    """
+    vectorizer = features.vectorizer()
+    results = []
+    with ProcessPoolExecutor(
+        processes,
+        initializer=_init_worker,
+        initargs=(features.x_train, features.y_train),
+    ) as executor:
+        fits = executor.map(_fit_classifier, [model for _, _, model in models])
+        for (name, filename, _), (classifier, elapsed, peak_memory) in zip(
+            models, fits
+        ):
+            pipeline = Pipeline(
+                [("vectorizer", vectorizer), ("classifier", classifier)]
+            )
+            save_model(pipeline, filename)
+            size = os.path.getsize(os.path.join(MODEL_DIR, filename))
+            results.append((name, filename, elapsed, peak_memory, size))
+    return results
+
+
+def streamed_accuracy(model, batches):
+    """Accuracy of a model on (sentences, labels) batches, or None without any."""
+    n_correct, n_total = 0, 0
+    for sentences, labels in batches:
+        n_correct += (model.predict(sentences) == labels).sum()
+        n_total += len(labels)
+    if n_total == 0:
+        return None
+    return n_correct / n_total
+
+
+def train_online_models(paths, batch_size=1000, checkpoint_every=10, resume=True):
+    """
+    Train all online models on the train split of some data files.
+
+    Returns the accuracy of each model on the test split of the same files, or None
+    if no sentence of the files is in the test split.
+    """
+    # Online models must know all labels up front
+    classes = sorted({dialog_act for dialog_act, _ in iter_dialog_data(paths)})
+    accuracies = {}
+    for name, filename, model in ONLINE_MODELS:
+        print(f"Training {name}...")
+        trained_model = train_online(
+            paths, classes, model, filename, batch_size, checkpoint_every, resume
+        )
+        test_batches = iter_dialog_chunks(paths, batch_size, split="test")
+        accuracies[name] = streamed_accuracy(trained_model, test_batches)
+    return accuracies
 
 
 if __name__ == "__main__":
-    x_train, x_test, y_train, y_test = create_dialog_dataset()
-    _, filename, model = select_model()
-    print("Training model...")
-    trained_model = train_model(x_train, y_train, model)
-    save_model(trained_model, filename)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--all", action="store_true", help="train all models")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--online", action="store_true", help="train online models")
+    parser.add_argument(
+        "--data", nargs="+", default=[DIALOG_ACTS_FILE], help="data files to stream"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--checkpoint-every", type=int, default=10)
+    parser.add_argument(
+        "--restart", action="store_true", help="don't continue from saved models"
+    )
+    args = parser.parse_args()
+
+    if args.online:
+        with stage("train online"):
+            accuracies = train_online_models(
+                args.data, args.batch_size, args.checkpoint_every, not args.restart
+            )
+        for name, accuracy in accuracies.items():
+            if accuracy is None:
+                print(f"{name}: no test data, no sentence is in the test split")
+            else:
+                print(f"{name}: accuracy on the test split {accuracy * 100:.2f}%")
+    elif args.all:
+        from prettytable import PrettyTable
+
+        with stage("load features"):
+            features = get_features()
+
+        print(f"Training {len(MODELS)} models...")
+        start = time.perf_counter()
+        with stage("train"):
+            results = train_all_models(features, processes=args.processes)
+        elapsed = time.perf_counter() - start
+
+        table = PrettyTable(["Model", "File", "Fit time", "Peak memory", "Size"])
+        for name, filename, fit_time, peak_memory, size in results:
+            table.add_row(
+                [
+                    name,
+                    os.path.join(MODEL_DIR, filename),
+                    f"{fit_time:.2f}s",
+                    "n/a" if peak_memory is None else f"{peak_memory / 2**20:.1f} MB",
+                    f"{size / 2**20:.1f} MB",
+                ]
+            )
+        print(table.get_string())
+        print(f"Trained all models in {elapsed:.2f}s")
+    else:
+        with stage("load features"):
+            features = get_features()
+        _, filename, model = select_model()
+        print("Training model...")
+        with stage("train"):
+            pipeline = train_model(features, model)
+        with stage("save"):
+            save_model(pipeline, filename)
@@ -1,53 +1,115 @@
-"""Own implementation of bag-of-words vectorization."""
+"""Own implementation of bag-of-words vectorization, into sparse matrices."""
+import zlib
+from array import array
 from collections import Counter
 
 import numpy as np
+from scipy.sparse import csr_matrix
 
-from extract import read_dialog_data
 
+def tokenize(sentence):
+    """Split a sentence into lowercase words."""
+    return sentence.lower().split()
 
-def vectorize(sentence, vocabulary):
-    """Vectorize a sentence based on vocabulary."""
 
-    # Create vector
-    vec = np.zeros(len(vocabulary))
+def hash_word(word, n_features):
+    """Column of a word in a hashed bag of words, which is the same in every run."""
+    return zlib.crc32(word.encode()) % n_features
 
-    # Split into seperate words
-    words = sentence.lower().split()
-    counts = Counter(words)
-    for word, freq in counts.items():
-        if word in vocabulary:
-            vec[vocabulary[word]] = freq
-    return vec
 
+class BagOfWordsVectorizer:
+    """
+    Vectorizer that counts the words of sentences into a sparse CSR matrix.
 
-def vectorize_all(sentences, vocabulary):
-    """Vectorize some amount of sentences based on vocabulary."""
-    matrix = np.zeros((len(sentences), len(vocabulary)))
+    By default columns are words of a vocabulary, that is learned when fitting.
+    Given n_features, words are hashed into that many columns instead, so there is
+    no vocabulary to fit or store, at the cost of words sharing columns.
+    """
 
-    for sent_id, sent in enumerate(sentences):
-        vec = vectorize(sent, vocabulary)
-        matrix[
-            sent_id:,
-        ] = vec
-    return matrix
+    def __init__(self, n_features=None):
+        self.n_features = n_features
+        self.vocabulary_ = None if n_features is not None else {}
 
+    @property
+    def hashing(self):
+        """Whether words are hashed into columns, rather than looked up."""
+        return self.n_features is not None
 
-def create_bag_of_words(x):
-    """Create a matrix bag of words representation of data x."""
-    word_sentence_map = {}
-    for sent_id, sentence in enumerate(x):
-        words = sentence.split()
-        counts = Counter(words)
-        for word, freq in counts.items():
-            if word not in word_sentence_map:
-                word_sentence_map[word] = {sent_id: freq}
+    def fit(self, sentences):
+        """Learn the vocabulary of some sentences."""
+        self.fit_transform(sentences)
+        return self
+
+    def transform(self, sentences):
+        """Count the words of sentences, words out of the vocabulary are ignored."""
+        return self._count(sentences, grow=False)
+
+    def fit_transform(self, sentences):
+        """Learn the vocabulary of sentences and count their words, in one pass."""
+        if not self.hashing:
+            self.vocabulary_ = {}
+        return self._count(sentences, grow=True)
+
+    def _count(self, sentences, grow):
+        """Build the CSR matrix of word counts, one row per sentence."""
+        # Typed arrays take a few bytes per element, rather than a Python int
+        indptr = array("q", [0])
+        indices = array("i")
+        data = array("q")
+        vocabulary = self.vocabulary_
+        # Columns of words hashed in this call, so each word is hashed only once
+        hashed = {}
+        for sentence in sentences:
+            words = tokenize(sentence)
+            if self.hashing:
+                columns = []
+                for word in words:
+                    if word not in hashed:
+                        hashed[word] = hash_word(word, self.n_features)
+                    columns.append(hashed[word])
+            elif grow:
+                columns = [
+                    vocabulary.setdefault(word, len(vocabulary)) for word in words
+                ]
             else:
-                word_sentence_map[word][sent_id] = freq
-
-    feature_matrix = np.zeros((len(word_sentence_map), len(x)))
-    for word_id, word in enumerate(word_sentence_map):
-        sentences = word_sentence_map[word]
-        for sent_id, freq in sentences.items():
-            feature_matrix[word_id][sent_id] = freq
-    return feature_matrix, {word: idx for idx, word in enumerate(word_sentence_map)}
+                columns = [vocabulary[word] for word in words if word in vocabulary]
+            counts = Counter(columns)
+            indices.extend(counts.keys())
+            data.extend(counts.values())
+            indptr.append(len(indices))
+
+        n_features = self.n_features if self.hashing else len(vocabulary)
+        matrix = csr_matrix(
+            (
+                np.frombuffer(data, dtype=np.int64),
+                np.frombuffer(indices, dtype=np.int32),
+                np.frombuffer(indptr, dtype=np.int64),
+            ),
+            shape=(len(indptr) - 1, n_features),
+        )
+        matrix.sort_indices()
+        return matrix
+
+
+def vectorize(sentence, vocabulary):
+    """Vectorize a sentence based on vocabulary, into a sparse row."""
+    return vectorize_all([sentence], vocabulary)
+
+
+def vectorize_all(sentences, vocabulary):
+    """Vectorize some amount of sentences based on vocabulary, one row each."""
+    vectorizer = BagOfWordsVectorizer()
+    vectorizer.vocabulary_ = vocabulary
+    return vectorizer.transform(sentences)
+
+
+def create_bag_of_words(x):
+    """
+    Create a matrix bag of words representation of data x.
+
+    Returns a sparse matrix with a row per word and a column per sentence, and the
+    vocabulary that maps words to their row.
+    """
+    vectorizer = BagOfWordsVectorizer()
+    matrix = vectorizer.fit_transform(x)
+    return matrix.T.tocsr(), vectorizer.vocabulary_